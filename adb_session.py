@@ -0,0 +1,210 @@
+import socket
+import subprocess
+import threading
+import itertools
+
+
+class AdbError(Exception):
+    """ADB 服务返回错误"""
+
+
+class AdbSession:
+    """ADB 长连接会话
+
+    直接通过 socket 与本机的 adb server 通信（adb host 协议），
+    不再为每条命令启动一个 adb 进程。点击、滑动等输入命令通过一个常驻的
+    sh 管道发送，截图等需要二进制输出的命令各自打开一个轻量的服务连接。
+    """
+
+    def __init__(self, adb_path="adb", serial=None, host="127.0.0.1", port=5037, timeout=10):
+        self.adb_path = adb_path
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._shell = None  # 常驻的 sh 连接
+        self._shell_buffer = b""
+        self._lock = threading.Lock()
+        self._markers = itertools.count()
+
+    def start_server(self):
+        """启动 adb server"""
+        subprocess.run([self.adb_path, "start-server"], capture_output=True)
+
+    def _connect(self):
+        """建立到 adb server 的 socket 连接，server 未启动时先启动"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError:
+            self.start_server()
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        """读取指定长度的数据"""
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbError("adb 连接被关闭")
+            data += chunk
+        return data
+
+    @staticmethod
+    def _recv_all(sock):
+        """读取数据直到连接关闭"""
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _request(self, sock, payload):
+        """发送一条 host 协议请求并检查返回状态"""
+        data = payload.encode("utf-8")
+        sock.sendall(b"%04x" % len(data) + data)
+        status = self._recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(self._recv_exact(sock, 4), 16)
+            message = self._recv_exact(sock, length).decode("utf-8", errors="replace")
+            raise AdbError(message)
+        raise AdbError(f"无法识别的响应: {status!r}")
+
+    def host_command(self, command):
+        """执行 host 命令（例如 host:devices），返回结果文本"""
+        with self._connect() as sock:
+            self._request(sock, command)
+            length = int(self._recv_exact(sock, 4), 16)
+            return self._recv_exact(sock, length).decode("utf-8", errors="replace")
+
+    def devices(self):
+        """列出已连接的设备，返回 [(序列号, 状态), ...]"""
+        devices = []
+        for line in self.host_command("host:devices").splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                devices.append((parts[0], parts[1]))
+        return devices
+
+    def connect(self, address):
+        """连接网络设备（相当于 adb connect），返回 adb 的提示信息"""
+        return self.host_command(f"host:connect:{address}")
+
+    def open_service(self, service):
+        """切换到当前设备并打开指定服务，返回 socket"""
+        sock = self._connect()
+        try:
+            if self.serial:
+                self._request(sock, f"host:transport:{self.serial}")
+            else:
+                self._request(sock, "host:transport-any")
+            self._request(sock, service)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def exec_out(self, command):
+        """执行命令并返回原始二进制输出（相当于 adb exec-out）"""
+        with self.open_service(f"exec:{command}") as sock:
+            return self._recv_all(sock)
+
+    def exec_out_into(self, command, buffer):
+        """执行命令并把输出读入 buffer（bytearray，不够大时自动扩大），返回数据长度
+
+        重复使用同一个 buffer 可以避免每次截图都重新分配内存
+        """
+        with self.open_service(f"exec:{command}") as sock:
+            size = 0
+            while True:
+                if size == len(buffer):
+                    buffer.extend(bytes(max(65536, len(buffer))))
+                view = memoryview(buffer)[size:]
+                try:
+                    received = sock.recv_into(view)
+                finally:
+                    view.release()
+                if not received:
+                    return size
+                size += received
+
+    def shell(self, command):
+        """执行一次性的 shell 命令并返回输出文本"""
+        with self.open_service(f"shell:{command}") as sock:
+            return self._recv_all(sock).decode("utf-8", errors="replace")
+
+    def _open_shell(self):
+        """打开常驻的 sh 管道
+
+        使用 exec:sh 而不是 shell:sh：Android 7 以前的 adbd（包括 MuMu 默认的 7555 端口）
+        会给 shell: 分配伪终端，输入的命令会被回显，输出中还会夹带提示符
+        """
+        self._shell = self.open_service("exec:sh")
+        self._shell_buffer = b""
+
+    def _send_to_shell(self, command):
+        """把命令发送到常驻 shell，返回标记编号"""
+        if self._shell is None:
+            self._open_shell()
+
+        # 每条命令后输出一个标记，读到标记说明命令已经执行完。
+        # 发送的是 __e7auto_""N__，即使命令被回显也不会包含完整的标记；
+        # exec: 没有单独的错误输出通道，错误信息合并到输出中
+        number = next(self._markers)
+        self._shell.sendall(f'{{ {command}; }} 2>&1; echo __e7auto_""{number}__\n'.encode("utf-8"))
+        return number
+
+    def _read_from_shell(self, number, timeout):
+        """读取命令的输出，直到读到编号为 number 的标记"""
+        marker = f"__e7auto_{number}__".encode()
+        self._shell.settimeout(timeout)
+        while marker not in self._shell_buffer:
+            chunk = self._shell.recv(4096)
+            if not chunk:
+                raise AdbError("adb shell 连接被关闭")
+            self._shell_buffer += chunk
+
+        output, _, self._shell_buffer = self._shell_buffer.partition(marker)
+        self._shell_buffer = self._shell_buffer.lstrip(b"\r\n")
+        return output.decode("utf-8", errors="replace")
+
+    def run(self, command, timeout=None):
+        """通过常驻 shell 执行命令，等待执行完成并返回输出
+
+        timeout 为等待执行完成的最长秒数，默认使用连接的超时时间。
+        连接或发送失败（模拟器重启、adb server 重启等）时自动重连一次；
+        命令发出之后出错不再重试，避免点击等输入被执行两次
+        """
+        with self._lock:
+            try:
+                number = self._send_to_shell(command)
+            except (OSError, AdbError):
+                self._close_shell()
+                number = self._send_to_shell(command)
+            try:
+                return self._read_from_shell(number, timeout or self.timeout)
+            except (OSError, AdbError):
+                # 连接状态未知，丢弃这个 shell，下次使用时重新打开
+                self._close_shell()
+                raise
+
+    def _close_shell(self):
+        if self._shell is not None:
+            try:
+                self._shell.close()
+            except OSError:
+                pass
+        self._shell = None
+        self._shell_buffer = b""
+
+    def close(self):
+        """关闭常驻连接"""
+        with self._lock:
+            self._close_shell()
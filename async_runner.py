@@ -0,0 +1,567 @@
+import asyncio
+import json
+import time
+
+from frame_cache import as_frame
+from screen_watcher import ScreenWatcher
+from stage_graph import compile_stage
+from metrics import metrics
+
+
+def print_log(message, debug=False):
+    """默认的日志输出：打印非调试信息"""
+    if not debug:
+        print(message)
+
+
+class AsyncStageRunner:
+    """基于 asyncio 的副本步骤执行器
+
+    截图和点击在 IO 线程池中执行，模板匹配交给控制器的匹配线程池，
+    所有等待都是 asyncio.sleep。一个事件循环可以同时调度大量设备，
+    取消任务时会在当前等待处立即停止。
+
+    副本配置先编译为状态机（stage_graph.StageGraph），每一帧只检查当前状态
+    相关的图片；必须点击的图片没有出现时，根据当前画面跳转到对应的状态。
+
+    连续几次都在同一位置点击成功的一串必须点击的状态，之后作为一个脚本一次发送到设备，
+    只在这串点击之后的检查点截图确认；检查点没有出现时改回逐个点击。
+    """
+
+    PHASE_NAMES = {"enter": "进入副本", "battle": "战斗中", "end": "结算"}
+    CLICK_TIMEOUT = 2      # 必须点击的图片最多再等待的秒数
+    MAX_RECOVERIES = 3     # 连续跳转状态的最大次数
+    STABLE_PASSES = 2      # 同一位置连续点击成功几次后可以批量点击
+    TAP_TOLERANCE = 10     # 视为同一点击位置的最大偏差（像素）
+    BATCH_MIN_TAPS = 2     # 批量点击的最少点击数
+    BATCH_MARGIN = 0.3     # 批量点击时每次点击后在记录的间隔上多等待的秒数
+    BATTLE_TIMEOUT_FACTOR = 3  # 有历史记录时，等待战斗结果最多为历史战斗时长 p90 的几倍
+
+    def __init__(self, game, config, stage_name="", log=None, io_executor=None):
+        self.game = game
+        self.controller = game.controller
+        self.config = config
+        self.stage_name = stage_name
+        self.log = log or print_log
+        self.io_executor = io_executor  # 截图和点击使用的线程池，None 表示事件循环默认线程池
+
+        self.battles = 0      # 已开始的战斗次数
+        self.battle_limit = 0  # 战斗次数限制，0 表示无限
+        self.state = "等待"   # 当前状态，用于显示
+        self.graph = None     # 由配置编译得到的状态机
+
+        self.batch_inputs = True  # 是否批量发送已知位置的点击
+        self._taps = {}           # {状态名称: (点击位置, 连续相同次数)}
+        self._delays = {}         # {状态名称: 点击后下一张图片出现所需的秒数}
+
+    @property
+    def running(self):
+        return self.game.running
+
+    async def _io(self, func, *args):
+        """在线程池中执行阻塞的 adb 操作"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, func, *args)
+
+    async def capture(self):
+        """截图"""
+        return await self._io(self.controller.capture)
+
+    async def tap(self, x, y):
+        """点击屏幕"""
+        await self._io(self.controller.tap, x, y)
+
+    async def find_all(self, templates, threshold=0.8, screen=None):
+        """在同一帧上查找多张图片，返回 {图片: 中心点坐标}，未找到的图片对应 None"""
+        results = {template: None for template in templates}
+        cached_templates = {}
+        for template in templates:
+            cached = self.game.templates.get(template)
+            if cached is None:
+                self.log(f"无法读取模板图片: {template}", debug=True)
+            else:
+                cached_templates[template] = cached
+        if not cached_templates:
+            return results
+
+        if screen is None:
+            screen = await self.capture()
+        if screen is None:
+            return results
+        # 所有模板共用同一个 Frame，灰度图等只计算一次
+        frame = as_frame(screen)
+
+        start_time = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if self.controller.match_pool is not None:
+            # 多进程匹配：整帧通过共享内存交给进程池
+            matches = await loop.run_in_executor(
+                self.io_executor, self.controller.match_templates, frame, list(cached_templates.values()), threshold
+            )
+        else:
+            # 每个模板单独提交到匹配线程池并行匹配
+            matches = await asyncio.gather(*(
+                loop.run_in_executor(self.controller.match_executor, self.controller.match_template,
+                                     frame, cached, threshold)
+                for cached in cached_templates.values()
+            ))
+
+        metrics.observe("find", time.perf_counter() - start_time, device=self.controller.serial)
+
+        scores = []
+        for template, (score, pos) in zip(cached_templates, matches):
+            scores.append(f"{template}={score:.2f}")
+            if score >= threshold:
+                results[template] = pos
+        self.log(f"图片匹配度: {', '.join(scores)}", debug=True)
+        return results
+
+    async def find_any(self, templates, threshold=0.8, screen=None):
+        """按顺序返回第一张找到的图片及其位置，都未找到时返回 (None, None)"""
+        results = await self.find_all(templates, threshold, screen)
+        for template in templates:
+            if results.get(template):
+                return template, results[template]
+        return None, None
+
+    async def check_and_click(self, image_num, max_retries=3, interval=1.0):
+        """检查并点击指定编号的图片"""
+        for retry in range(max_retries):
+            if not self.running:
+                return False
+            _, pos = await self.find_any([image_num])
+            if pos:
+                self.log(f"找到图片 {image_num}，点击位置: {pos}", debug=True)
+                await self.tap(pos[0], pos[1])
+                return True
+            await asyncio.sleep(interval)
+        return False
+
+    async def wait_until(self, templates, timeout, min_interval=0.2, max_interval=1.0, backoff=1.5):
+        """等待任意一张图片出现，最多等待 timeout 秒，返回 (图片, 位置)"""
+        with metrics.span("wait", kind="until"):
+            deadline = time.time() + timeout
+            delay = min_interval
+            while self.running:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * backoff, max_interval)
+
+                found, pos = await self.find_any(templates)
+                if found is not None:
+                    return found, pos
+            return None, None
+
+    async def wait_until_stable(self, timeout, poll_interval=0.2, after_change=False):
+        """等待画面静止，最多等待 timeout 秒，画面静止时返回 True
+
+        after_change 为 True 时先等画面发生变化，变化后再静止下来才返回，
+        避免点击还没有生效时就把原来的画面当作已经稳定
+        """
+        with metrics.span("wait", kind="stable"):
+            watcher = ScreenWatcher()
+            changed = not after_change
+            deadline = time.time() + timeout
+            while self.running and time.time() < deadline:
+                await asyncio.sleep(min(poll_interval, max(0, deadline - time.time())))
+                frame = await self.capture()
+                if frame is None:
+                    continue
+                settled = watcher.update(frame)
+                if watcher.changing:
+                    changed = True
+                if settled and changed:
+                    return True
+            return False
+
+    async def watch_for(self, templates, interval=5, poll_interval=0.5, first_delay=0, fast_until=None, fast_interval=1.0,
+                        max_poll_interval=2.0, backoff=1.5, timeout=None):
+        """等待任意一张图片出现，画面稳定或超过检查间隔时才进行模板匹配，返回 (图片, 位置)
+
+        超过 timeout 秒（从调用时算起）仍未出现时返回 (None, None)，None 表示一直等待
+
+        截图间隔自适应：画面持续变化（战斗动画）时结果画面还没有出现，间隔逐渐放宽到
+        max_poll_interval；画面静止或进入预计结束的时间段时恢复为 poll_interval，
+        以便尽快确认画面稳定
+        """
+        start_time = time.time()
+        if first_delay > 0:
+            await asyncio.sleep(first_delay)
+
+        watcher = ScreenWatcher()
+        last_check = 0
+        delay = poll_interval
+        while self.running and (timeout is None or time.time() - start_time < timeout):
+            # 画面检测和模板匹配共用这一帧的灰度图
+            frame = as_frame(await self.capture())
+            settled = frame is not None and watcher.update(frame)
+            now = time.time()
+            check_interval = interval
+            if fast_until is not None and now - start_time <= fast_until:
+                check_interval = min(interval, fast_interval)
+            if frame is not None and (settled or now - last_check >= check_interval):
+                last_check = now
+                found, pos = await self.find_any(templates, screen=frame)
+                if found is not None:
+                    return found, pos
+
+            in_fast_window = fast_until is not None and time.time() - start_time <= fast_until
+            if watcher.changing and not in_fast_window:
+                delay = min(delay * backoff, max_poll_interval)
+            else:
+                delay = poll_interval
+            await asyncio.sleep(delay)
+        return None, None
+
+    async def handle_energy_check(self, image=12, pos=None):
+        """处理体力不足的情况，pos 为已经找到的体力不足提示位置"""
+        game = self.game
+        if pos is None:
+            _, pos = await self.find_any([image])
+            if pos is None:
+                return True
+
+        self.log(f"发现体力不足提示（当前已购买 {game.energy_purchase_count} 次）")
+        if game.energy_purchase_count >= game.max_energy_purchase:
+            self.log(f"已达到体力购买上限 {game.max_energy_purchase} 次，程序结束")
+            return False
+
+        self.log(f"购买体力，第 {game.energy_purchase_count + 1} 次")
+        for retry in range(3):
+            if pos is not None:
+                await self.tap(pos[0], pos[1])
+                pos = None
+                clicked = True
+            else:
+                clicked = await self.check_and_click(image)
+            if clicked:
+                game.energy_purchase_count += 1
+                # 等待购买完成和界面刷新，图片6出现后立即继续
+                _, start_pos = await self.wait_until([6], 5)
+                if start_pos is not None:
+                    await self.tap(start_pos[0], start_pos[1])
+                elif not await self.check_and_click(6):
+                    self.log("点击图片6失败，重试...")
+                    continue
+                return True
+            self.log(f"第 {retry + 1} 次点击购买按钮失败")
+            await asyncio.sleep(1)
+
+        self.log("多次尝试购买体力失败")
+        return False
+
+    async def run(self, battle_limit=0):
+        """执行副本，battle_limit 为 0 时无限循环，返回完成的战斗次数"""
+        try:
+            self.log(f"战斗次数限制: {battle_limit if battle_limit > 0 else '无限'}")
+
+            # 只显示配置摘要，完整配置作为调试信息
+            self.log(f"当前配置: {self.config.get('description', self.stage_name)}，共 {len(self.config.get('steps', []))} 个步骤")
+            self.log(json.dumps(self.config, ensure_ascii=False), debug=True)
+
+            # 确保成功连接模拟器
+            self.state = "连接中"
+            if not await self._io(self.controller.connect_to_mumu):
+                self.log("连接模拟器失败，请检查模拟器是否正常运行")
+                self.state = "连接失败"
+                return self.battles
+
+            self.log("开始执行自动化任务")
+
+            # 检查配置格式
+            if "steps" not in self.config:
+                self.log("错误: 配置格式不正确，缺少 'steps' 字段")
+                self.state = "配置错误"
+                return self.battles
+            self.apply_config()
+
+            # 配置只编译一次，之后按状态机执行
+            self.graph = compile_stage(self.config)
+            await self.run_graph(battle_limit)
+
+        except asyncio.CancelledError:
+            self.state = "已停止"
+            raise
+        except Exception as e:
+            self.state = "出错"
+            self.log(f"发生错误: {e}")
+            import traceback
+            self.log(traceback.format_exc())
+        finally:
+            if self.state not in ("出错", "已停止"):
+                self.state = "已结束"
+            self.controller.close()
+            self.log(f"自动化任务结束，共完成 {self.battles} 次战斗")
+        return self.battles
+
+    def apply_config(self):
+        """把副本配置中的查找区域和匹配方式应用到控制器"""
+        templates = self.game.templates
+        self.controller.rois = templates.parse_rois(self.config.get("rois"))
+        self.controller.match_methods = templates.parse_match_methods(self.config.get("match_methods"))
+        self.controller.match_method = self.config.get("match_method", "full")
+        self.batch_inputs = self.config.get("batch_inputs", True)
+
+    async def run_graph(self, battle_limit=0):
+        """从起始状态开始执行状态机，每个状态只检查与它相关的图片
+
+        达到战斗次数限制后，在重新开始的点击和购买体力之前停止，不会开始多余的一次战斗
+        """
+        self.battle_limit = battle_limit
+        graph = self.graph
+        name = graph.start
+        pos = None          # 上一个状态等待时已经找到的图片位置
+        phase = None
+        phase_start = time.time()
+        recoveries = 0
+        recovered = False   # 跳转过的阶段不记录耗时
+        from_recovery = False  # 当前状态是否由 recover() 跳转而来
+
+        while self.running and name is not None:
+            state = graph.states[name]
+
+            # 阶段切换：记录上一阶段的耗时
+            if state.phase != phase:
+                if phase in ("enter", "end") and not recovered:
+                    self.game.timing.record(self.stage_name, phase, time.time() - phase_start)
+                phase = state.phase
+                phase_start = time.time()
+                recovered = False
+                self.state = self.PHASE_NAMES.get(phase, phase)
+                if phase == "enter":
+                    self.log("开始进入副本...")
+
+            # 检查是否达到战斗次数限制
+            if (state.restarts or state.kind == "battle") and self.limit_reached():
+                self.log(f"已达到战斗次数限制: {battle_limit}")
+                break
+            if state.kind == "battle":
+                if from_recovery:
+                    # 跳转时战斗可能已经进行了一段时间或已经结束，不计数
+                    self.log("跳转到战斗状态，等待战斗结果")
+                else:
+                    self.battles += 1
+                    self.log(f"开始第 {self.battles} 次战斗")
+
+            start_time = time.perf_counter()
+            batch, checkpoint = self.plan_batch(name) if self.batch_inputs else ([], None)
+            if batch:
+                next_name, pos = await self.execute_batch(batch, checkpoint, pos)
+            else:
+                next_name, pos = await self.execute_state(state, pos, from_recovery)
+            metrics.observe("step", time.perf_counter() - start_time, stage=self.stage_name, state=state.name)
+            if next_name is not None:
+                recoveries = 0
+                from_recovery = False
+                name = next_name
+                continue
+
+            # 必须点击的图片没有出现或等待战斗结果超时：根据当前画面跳转到对应的状态
+            if (state.kind not in ("click", "battle") and not batch) or not self.running or recoveries >= self.MAX_RECOVERIES:
+                if state.phase == "enter":
+                    self.log("进入副本失败")
+                break
+            recoveries += 1
+            metrics.inc("recoveries", stage=self.stage_name, state=state.name)
+            name = await self.recover()
+            recovered = True
+            from_recovery = True
+
+    def limit_reached(self):
+        """是否已经达到战斗次数限制"""
+        return self.battle_limit > 0 and self.battles >= self.battle_limit
+
+    async def execute_state(self, state, pos=None, recovered=False):
+        """执行一个状态，返回 (下一个状态名称, 下一张图片的位置)，失败时返回 (None, None)
+
+        pos 为上一个状态等待时已经找到的位置，此时直接点击，不再重复截图查找；
+        recovered 表示该状态是跳转而来的
+        """
+        if state.kind == "battle":
+            return await self.execute_battle(state, recovered)
+
+        if state.kind == "energy":
+            if pos is None:
+                _, pos = await self.find_any(state.templates)
+            if pos is not None and not await self.handle_energy_check(state.templates[0], pos):
+                return None, None
+            return state.next_state, None
+
+        image = state.templates[0]
+        if pos is None:
+            _, pos = await self.find_any([image])
+        if pos is None and state.kind == "click":
+            _, pos = await self.wait_until([image], self.CLICK_TIMEOUT)
+        if pos is None:
+            self._taps.pop(state.name, None)
+            if state.kind == "click":
+                self.log(f"点击图片 {image} 失败")
+                if state.required:
+                    return None, None
+            return state.next_state, None
+
+        self.log(f"找到图片 {image}，点击位置: {pos}", debug=True)
+        await self.tap(pos[0], pos[1])
+        self.learn_tap(state.name, pos)
+
+        # 下一个状态是点击时，等待它的图片出现后立即继续，wait 作为最长等待时间
+        following = self.graph.states.get(state.next_state)
+        if following is not None and following.kind in ("click", "optional_click"):
+            tap_time = time.perf_counter()
+            _, next_pos = await self.wait_until(following.templates, state.wait)
+            if next_pos is not None:
+                self._delays[state.name] = time.perf_counter() - tap_time
+            else:
+                self._delays.pop(state.name, None)
+            return state.next_state, next_pos
+        # 下一个状态是体力检查时，提示要等点击生效后才弹出，先等画面变化再等静止
+        await self.wait_until_stable(state.wait, after_change=following is not None and following.kind == "energy")
+        return state.next_state, None
+
+    def learn_tap(self, name, pos):
+        """记录状态的点击位置，与上次位置相同时累计次数"""
+        previous = self._taps.get(name)
+        if previous is not None and all(abs(a - b) <= self.TAP_TOLERANCE for a, b in zip(previous[0], pos)):
+            self._taps[name] = (pos, previous[1] + 1)
+        else:
+            self._taps[name] = (pos, 1)
+
+    def plan_batch(self, name):
+        """从 name 开始可以批量点击的状态列表和之后用于确认的检查点状态
+
+        只包含同一阶段内、位置已经稳定并且记录了点击间隔的必须点击的状态（例如进入副本），
+        "有就点击"的状态画面不固定，不能盲点。检查点是最后一个批量点击之后的点击状态。
+        不足 BATCH_MIN_TAPS 个时返回 ([], None)。达到战斗次数限制后不再批量点击重新开始的状态
+        """
+        batch = []
+        phase = self.graph.states[name].phase
+        while True:
+            state = self.graph.states.get(name)
+            if (state is None or state in batch or state.kind != "click" or not state.required
+                    or state.phase != phase or (state.restarts and self.limit_reached())
+                    or name not in self._delays or self._taps.get(name, (None, 0))[1] < self.STABLE_PASSES):
+                break
+            batch.append(state)
+            name = state.next_state
+        if len(batch) < self.BATCH_MIN_TAPS:
+            return [], None
+        # 记录了点击间隔说明下一个状态也是点击，可以作为检查点
+        return batch, self.graph.states[batch[-1].next_state]
+
+    async def execute_batch(self, states, checkpoint, pos=None):
+        """把一串已知位置的点击一次发送到设备，只在检查点截图确认
+
+        返回 (检查点状态名称, 检查点图片位置)，检查点没有出现时返回 (None, None)，
+        并清除这些状态的位置记录，之后改回逐个点击
+        """
+        actions = []
+        for index, state in enumerate(states):
+            tap_pos = pos if index == 0 and pos is not None else self._taps[state.name][0]
+            # 最后一次点击之后由检查点等待
+            delay = 0 if index + 1 == len(states) else min(state.wait, self._delays[state.name] + self.BATCH_MARGIN)
+            actions.append({"action": "tap", "x": tap_pos[0], "y": tap_pos[1], "delay": delay})
+
+        images = [state.templates[0] for state in states]
+        self.log(f"批量点击图片 {images}", debug=True)
+        sent = await self._io(self.controller.run_inputs, actions)
+        metrics.inc("batched_taps", len(actions), stage=self.stage_name)
+
+        next_pos = None
+        if sent:
+            _, next_pos = await self.wait_until(checkpoint.templates, states[-1].wait)
+        if next_pos is None:
+            self.log(f"批量点击 {images} 后没有找到图片 {checkpoint.templates[0]}，改为逐个点击")
+            for state in states:
+                self._taps.pop(state.name, None)
+            return None, None
+        return checkpoint.name, next_pos
+
+    async def execute_battle(self, state, recovered=False):
+        """等待战斗结束，返回 (对应战斗结果的下一个状态名称, None)
+
+        recovered 为 True 时（跳转到战斗状态）战斗开始时间未知：立即开始检查，
+        也不记录这次的战斗时长。等待中出现体力不足提示时返回 (体力检查状态, 提示位置)；
+        超时返回 (None, None)，由调用方根据当前画面跳转
+        """
+        self.log("检查战斗状态...")
+
+        # 根据历史战斗时长推迟首次检查，并在预计结束前后频繁检查
+        first_delay, fast_until = 0, None
+        if not recovered:
+            first_delay, fast_until = self.game.timing.schedule(self.stage_name, "battle")
+        if fast_until is not None:
+            self.log(f"预计 {first_delay:.0f} 秒后开始检查战斗结果", debug=True)
+
+        # 最长等待时间：有历史记录时为 p90 的几倍，不超过配置的上限
+        timeout = state.timeout
+        p90 = self.game.timing.percentile(self.stage_name, "battle", 90)
+        if p90 is not None:
+            timeout = min(timeout, p90 * self.BATTLE_TIMEOUT_FACTOR)
+
+        # 画面稳定或超过检查间隔时才匹配，同一帧上检查所有可能的结果和体力不足提示
+        energy = self.graph.states.get(state.energy) if state.energy else None
+        start_time = time.time()
+        found, pos = await self.watch_for(
+            state.templates + (energy.templates if energy is not None else []),
+            interval=state.interval,
+            first_delay=first_delay,
+            fast_until=fast_until,
+            timeout=timeout
+        )
+        if not self.running:
+            return None, None
+        if found is None:
+            self.log(f"等待战斗结果超过 {timeout:.0f} 秒")
+            return None, None
+        if found not in state.results:
+            # 体力不足，战斗没有开始，购买体力后重新开始时再计数
+            self.log("等待战斗结果时发现体力不足提示")
+            if not recovered:
+                self.battles -= 1
+            return energy.name, pos
+        if not recovered:
+            self.game.timing.record(self.stage_name, "battle", time.time() - start_time)
+            metrics.observe("battle", time.time() - start_time, stage=self.stage_name)
+
+        result = state.results[found]
+        metrics.inc("battles", stage=self.stage_name, result=result["type"] or "end")
+        if result["type"]:
+            self.log(f"战斗{result['type']}结束")
+        else:
+            self.log("战斗结束")
+
+        # 等待结算画面静止，最多等待 wait_after_check 秒
+        wait_time = result["wait_after_check"]
+        self.log(f"最多等待 {wait_time} 秒后继续...", debug=True)  # 调试信息
+        await self.wait_until_stable(wait_time)
+        return result["next"], None
+
+    async def recover(self):
+        """画面与预期不符时，根据当前画面返回应该跳转到的状态名称
+
+        先用画面识别器一次比较所有已知画面；识别不出时在同一帧上检查
+        状态机中的所有图片，并记住这一帧，下次遇到同样的画面可以直接识别
+        """
+        frame = as_frame(await self.capture())
+        if frame is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        classifier = self.game.classifier
+        label, score = await loop.run_in_executor(self.controller.match_executor, classifier.classify,
+                                                 frame, self.controller.learned_rois)
+        name = self.graph.resolve(label)
+        if name is not None:
+            self.log(f"识别到当前画面 {label}（{score:.2f}），跳转到状态 {name}")
+            return name
+
+        results = await self.find_all(self.graph.all_templates(), screen=frame)
+        found = [template for template, pos in results.items() if pos]
+        name = self.graph.locate(found)
+        if name is not None:
+            # 按图片编号记住画面，多台设备运行不同副本时也能共用
+            classifier.add_capture(next(t for t in self.graph.states[name].templates if t in found), frame)
+            self.log(f"当前画面与预期不符，跳转到状态 {name}")
+        return name
@@ -0,0 +1,268 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matcher
+from template_cache import TemplateCache
+
+
+def summarize(samples):
+    """统计耗时样本（秒），返回以毫秒为单位的分位数"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(q):
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """屏蔽被测代码中的 print，避免输出影响计时"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def load_frames(frames_dir):
+    """读取截图文件夹中的所有截图，返回 [(文件名, 图像), ...]"""
+    import cv2
+
+    frames = []
+    for name in sorted(os.listdir(frames_dir)):
+        if name.lower().endswith(".png"):
+            frame = cv2.imread(os.path.join(frames_dir, name))
+            if frame is not None:
+                frames.append((name, frame))
+    return frames
+
+
+def synthetic_frames(configs, templates):
+    """没有录制的截图时，使用副本配置生成的合成画面"""
+    from fake_device import synthetic_script
+
+    frames = []
+    for stage, config in configs.items():
+        script = synthetic_script(config, templates)
+        for name, screen in script["screens"].items():
+            frames.append((f"{stage}/{name}", screen["frames"][0]))
+    return frames
+
+
+def template_scale(frame, resolution=(1920, 1080)):
+    """截图相对于模板分辨率的缩放比例（按短边计算）"""
+    return min(frame.shape[:2]) / min(resolution)
+
+
+def bench_matching(frames, templates, repeat=3, threshold=0.8):
+    """每个模板、每种匹配方式在每张截图上的整帧匹配耗时"""
+    results = {}
+    for key in templates.keys():
+        cached = templates.get(key)
+        per_method = {}
+        for method in matcher.MATCH_METHODS:
+            samples, found = [], 0
+            for _, frame in frames:
+                scaled = cached.rescaled(template_scale(frame))
+                for _ in range(repeat):
+                    start_time = time.perf_counter()
+                    score, _ = matcher.match(frame, scaled, threshold, method)
+                    samples.append(time.perf_counter() - start_time)
+                found += score >= threshold
+            per_method[method] = dict(summarize(samples), found=found)
+        results[str(key)] = per_method
+    return results
+
+
+def _static_controller(frame, templates):
+    from fake_device import FakeController
+
+    script = {"start": "frame", "screens": {"frame": {"frames": [frame]}}}
+    controller = FakeController(script, templates=templates)
+    # 画面始终不变，开启匹配结果缓存时除第一次外都会命中缓存，测不到真实的匹配耗时
+    controller.match_memo = None
+    return controller
+
+
+def bench_find(frames, templates, repeat=3, threshold=0.8, verbose=False):
+    """通过控制器查找和点击的端到端耗时（包括截图、查找区域和匹配方式的选择）"""
+    results = {"find_image": [], "find_image_hit": [], "click_image": [], "find_all": []}
+    keys = templates.keys()
+    for _, frame in frames:
+        with quiet(not verbose):
+            controller = _static_controller(frame, templates)
+        for _ in range(repeat):
+            for key in keys:
+                with quiet(not verbose):
+                    start_time = time.perf_counter()
+                    pos = controller.find_image(key, threshold)
+                    elapsed = time.perf_counter() - start_time
+                results["find_image"].append(elapsed)
+                if pos:
+                    results["find_image_hit"].append(elapsed)
+                    with quiet(not verbose):
+                        start_time = time.perf_counter()
+                        controller.click_image(key, threshold)
+                        results["click_image"].append(time.perf_counter() - start_time)
+
+            with quiet(not verbose):
+                start_time = time.perf_counter()
+                controller.find_all(keys, threshold)
+                results["find_all"].append(time.perf_counter() - start_time)
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def bench_stage(stage, config, templates, cycles=3, speed=10.0, battle_seconds=5.0, script=None, verbose=False):
+    """在模拟设备上完整执行副本，统计进入副本和每次战斗循环的耗时
+
+    script 为录制的画面脚本（fake_device.load_script 的参数），
+    为 None 时使用 synthetic_script 生成的合成画面
+    """
+    from fake_device import FakeController, synthetic_script
+    from game_automation import GameAutomation
+    from stage_runner import StageRunner
+    from timing_profile import TimingProfile
+
+    if script is None:
+        script = synthetic_script(config, templates, battle_seconds=battle_seconds)
+    battle_starts = []
+
+    def log(message, debug=False):
+        if message.startswith("开始第"):
+            battle_starts.append(time.perf_counter())
+        if verbose and not debug:
+            print(f"[{stage}] {message}")
+
+    with tempfile.TemporaryDirectory() as temp_dir, quiet(not verbose):
+        # 使用临时的耗时统计，不影响正常运行时的记录
+        timing = TimingProfile(os.path.join(temp_dir, "timing_stats.json"))
+        controller = FakeController(script, templates=templates, speed=speed)
+        game = GameAutomation(controller=controller, templates=templates, timing=timing)
+        runner = StageRunner(game, config, stage, log=log)
+
+        start_time = time.perf_counter()
+        battles = runner.run(cycles)
+        end_time = time.perf_counter()
+
+    enter_times = [battle_starts[0] - start_time] if battle_starts else []
+    cycle_times = [b - a for a, b in zip(battle_starts, battle_starts[1:] + [end_time])]
+    return {
+        "battles": battles,
+        "speed": speed,
+        "total_seconds": round(end_time - start_time, 3),
+        "enter": summarize(enter_times),
+        "cycle": summarize(cycle_times),
+        "taps": len(controller.inputs),
+        "final_screen": controller.screen_name,
+    }
+
+
+def git_version():
+    """当前代码版本（git 提交），无法获取时返回 None"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, previous, path=()):
+    """打印两次结果中 p50 的变化"""
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        if isinstance(value, dict) and "p50" in value:
+            if isinstance(old, dict) and old.get("p50"):
+                change = (value["p50"] - old["p50"]) / old["p50"] * 100
+                print(f"{'/'.join(path + (key,))}: p50 {old['p50']:.2f} -> {value['p50']:.2f} 毫秒 ({change:+.1f}%)")
+        elif isinstance(value, dict):
+            compare(value, old or {}, path + (key,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="不连接模拟器，测试截图匹配和副本执行的耗时")
+    parser.add_argument("--frames", help="录制的截图文件夹，不指定时使用合成画面")
+    parser.add_argument("--images", default="images", help="模板图片文件夹")
+    parser.add_argument("--configs", default="stage_configs.json", help="副本配置文件")
+    parser.add_argument("--stages", nargs="*", default=["支线33", "龙13"], help="要测试的副本")
+    parser.add_argument("--scripts", help="录制的画面脚本文件夹，按 <副本名称>/script.json 存放")
+    parser.add_argument("--repeat", type=int, default=3, help="每项匹配测试的重复次数")
+    parser.add_argument("--cycles", type=int, default=3, help="每个副本执行的战斗次数")
+    parser.add_argument("--speed", type=float, default=10.0, help="模拟设备的时间加速倍数")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["matching", "find", "stages"], help="跳过的测试")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果保存位置")
+    parser.add_argument("--compare", help="与之前保存的结果比较")
+    parser.add_argument("--verbose", action="store_true", help="显示被测代码的输出")
+    args = parser.parse_args(argv)
+
+    with open(args.configs, "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    configs = {stage: configs[stage] for stage in args.stages if stage in configs}
+
+    with quiet(not args.verbose):
+        templates = TemplateCache(args.images)
+    frames = load_frames(args.frames) if args.frames else synthetic_frames(configs, templates)
+    print(f"模板 {len(templates.keys())} 张，截图 {len(frames)} 张")
+
+    results = {
+        "version": git_version(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "frames": args.frames or "synthetic",
+    }
+
+    if "matching" not in args.skip:
+        print("测试模板匹配...")
+        results["matching"] = bench_matching(frames, templates, args.repeat)
+    if "find" not in args.skip:
+        print("测试查找和点击...")
+        results["find"] = bench_find(frames, templates, args.repeat, verbose=args.verbose)
+    if "stages" not in args.skip:
+        results["stages"] = {}
+        for stage, config in configs.items():
+            print(f"测试副本 {stage}...")
+            script = None
+            if args.scripts and os.path.isdir(os.path.join(args.scripts, stage)):
+                script = os.path.join(args.scripts, stage)
+            results["stages"][stage] = bench_stage(stage, config, templates, args.cycles, args.speed,
+                                                   script=script, verbose=args.verbose)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"结果已保存到 {args.output}")
+
+    for name, stat in results.get("find", {}).items():
+        if stat["count"]:
+            print(f"{name}: p50 {stat['p50']:.2f} 毫秒, p90 {stat['p90']:.2f} 毫秒")
+    for stage, stat in results.get("stages", {}).items():
+        if stat["cycle"]["count"]:
+            print(f"{stage}: 完成 {stat['battles']} 次战斗, 每次循环 p50 {stat['cycle']['p50'] / 1000:.2f} 秒")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
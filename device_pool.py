@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from adb_session import AdbSession
+from async_runner import AsyncStageRunner
+from game_automation import GameAutomation
+from template_cache import TemplateCache
+from timing_profile import TimingProfile
+from screen_classifier import ScreenClassifier
+from metrics import metrics
+
+
+class DevicePool:
+    """在一个进程中同时驱动多台模拟器
+
+    从 adb devices 发现所有设备，为每台设备分配一个副本配置，所有设备的步骤
+    都在同一个后台事件循环中调度。所有设备共享同一个模板缓存、耗时统计和
+    一个大小受限的匹配线程池（cv2.matchTemplate 运行时会释放 GIL，
+    多线程可以利用多个 CPU 核心），截图和点击使用另一个 IO 线程池。
+    """
+
+    def __init__(self, adb_path, configs, default_stage=None, assignments=None,
+                 match_workers=None, io_workers=32, energy_limit=3, battle_limit=0,
+                 process_matching=False, capture_threads=False, metrics_path=None, metrics_port=None, log=None,
+                 input_backend="input"):
+        self.adb_path = adb_path
+        self.configs = configs                  # 全部副本配置 {副本名称: 配置}
+        self.default_stage = default_stage      # 未单独指定的设备运行的副本
+        self.assignments = assignments or {}    # 单独指定 {设备序列号: 副本名称}
+        self.energy_limit = energy_limit
+        self.battle_limit = battle_limit
+        self.capture_threads = capture_threads  # 每台设备使用后台截图线程
+        self.metrics_path = metrics_path        # 定期保存耗时统计的文件（.json 或 Prometheus 文本）
+        self.log = log                          # 日志函数 log(消息, debug)，None 时打印非调试信息
+        self.input_backend = input_backend      # 点击方式：input / sendevent
+        if metrics_port:
+            metrics.serve(metrics_port)
+
+        self.templates = TemplateCache()
+        self.timing = TimingProfile()
+        self.classifier = ScreenClassifier(self.templates)
+        self.match_executor = ThreadPoolExecutor(max_workers=match_workers or os.cpu_count() or 1)
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers)
+        # 可选的多进程匹配，截图通过共享内存传给子进程
+        self.match_pool = None
+        if process_matching:
+            from match_pool import ProcessMatchPool
+            self.match_pool = ProcessMatchPool(self.templates.images_dir, match_workers)
+
+        self.runners = {}  # {设备序列号: AsyncStageRunner}
+        self.futures = {}  # {设备序列号: 运行结果 Future}
+        self._log_lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+
+    def discover(self):
+        """列出所有在线的设备序列号"""
+        return [serial for serial, state in AdbSession(self.adb_path).devices() if state == "device"]
+
+    def stage_for(self, serial):
+        """获取设备要运行的副本名称"""
+        return self.assignments.get(serial, self.default_stage)
+
+    def _device_log(self, serial):
+        """生成带设备序列号前缀的日志函数"""
+        def log(message, debug=False):
+            if self.log is not None:
+                self.log(f"[{serial}] {message}", debug)
+            elif not debug:
+                with self._log_lock:
+                    print(f"[{serial}] {message}")
+        return log
+
+    def start(self, serials=None):
+        """在指定设备（默认全部在线设备）上开始运行，返回成功启动的设备序列号"""
+        if serials is None:
+            serials = self.discover()
+
+        started = []
+        for serial in serials:
+            if serial in self.futures and not self.futures[serial].done():
+                print(f"设备 {serial} 已在运行")
+                continue
+
+            stage = self.stage_for(serial)
+            config = self.configs.get(stage)
+            if not config:
+                print(f"设备 {serial} 没有可用的副本配置，跳过")
+                continue
+
+            game = GameAutomation(adb_path=self.adb_path, serial=serial, templates=self.templates, timing=self.timing,
+                                  classifier=self.classifier)
+            game.max_energy_purchase = self.energy_limit
+            game.controller.match_executor = self.match_executor
+            game.controller.match_pool = self.match_pool
+            game.controller.input_backend = self.input_backend
+            if self.capture_threads:
+                game.controller.start_capture_thread()
+
+            runner = AsyncStageRunner(game, config, stage, log=self._device_log(serial), io_executor=self.io_executor)
+            self.runners[serial] = runner
+            self.futures[serial] = asyncio.run_coroutine_threadsafe(runner.run(self.battle_limit), self._loop)
+            print(f"设备 {serial} 开始运行副本: {stage}")
+            started.append(serial)
+        return started
+
+    def status(self):
+        """所有设备的运行状态列表"""
+        return [
+            {
+                "serial": serial,
+                "stage": runner.stage_name,
+                "state": runner.state,
+                "battles": runner.battles,
+                "alive": not self.futures[serial].done(),
+            }
+            for serial, runner in self.runners.items()
+        ]
+
+    def print_status(self):
+        """打印所有设备的运行状态"""
+        with self._log_lock:
+            print("设备状态：")
+            for info in self.status():
+                print(f"  {info['serial']}  {info['stage']}  {info['state']}  战斗 {info['battles']} 次")
+
+    def wait(self, report_interval=60):
+        """等待所有设备运行结束，期间定期打印状态"""
+        while True:
+            done, pending = wait(list(self.futures.values()), timeout=report_interval)
+            self.print_status()
+            self.save_metrics()
+            if not pending:
+                break
+
+    def save_metrics(self):
+        """保存耗时统计（设置了 metrics_path 时）"""
+        if self.metrics_path:
+            try:
+                metrics.write(self.metrics_path)
+            except OSError as e:
+                print(f"保存耗时统计失败: {e}")
+
+    def stop(self, timeout=5):
+        """停止所有设备，正在执行的步骤会被立即取消"""
+        for runner in self.runners.values():
+            runner.game.stop()
+        for future in self.futures.values():
+            future.cancel()
+        deadline = time.time() + timeout
+        while any(not future.done() for future in self.futures.values()) and time.time() < deadline:
+            time.sleep(0.1)
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=max(0, deadline - time.time()))
+        self.match_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+        if self.match_pool is not None:
+            self.match_pool.shutdown()
+        self.save_metrics()
+        metrics.stop_server()
@@ -0,0 +1,322 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from game_automation import MumuController
+from metrics import metrics
+
+
+def load_script(path):
+    """读取模拟设备的画面脚本
+
+    path 为包含 script.json 的文件夹时按脚本运行；只有截图的文件夹
+    （例如 record() 录制的结果）按录制时间依次回放，点击不会改变画面。
+
+    script.json 格式:
+    {
+        "start": "首页",
+        "screens": {
+            "首页": {
+                "frames": ["home.png"],                  // 或 [{"file": "a.png", "t": 0.0}, ...] 按时间播放
+                "taps": [
+                    {"image": 1, "next": "副本列表", "delay": 0.3},  // 点击图片1所在位置
+                    {"box": [x1, y1, x2, y2], "next": "设置"},      // 点击指定区域
+                    {"next": "首页"}                                // 点击任意位置
+                ],
+                "after": {"seconds": 30, "next": "战斗结束"}       // 停留一段时间后自动切换
+            }
+        }
+    }
+    """
+    script_path = os.path.join(path, "script.json")
+    if os.path.exists(script_path):
+        with open(script_path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        script.setdefault("base_dir", path)
+        return script
+
+    # 没有脚本时把录制的截图按时间连成一条链
+    timestamps = {}
+    frames_path = os.path.join(path, "frames.json")
+    if os.path.exists(frames_path):
+        with open(frames_path, "r", encoding="utf-8") as f:
+            timestamps = json.load(f)
+    names = sorted(name for name in os.listdir(path) if name.lower().endswith(".png"))
+    if not names:
+        raise ValueError(f"文件夹中没有截图: {path}")
+
+    screens = {}
+    for index, name in enumerate(names):
+        screen = {"frames": [name]}
+        if index + 1 < len(names):
+            current = timestamps.get(name, index * 0.5)
+            following = timestamps.get(names[index + 1], (index + 1) * 0.5)
+            screen["after"] = {"seconds": max(0.0, following - current), "next": names[index + 1]}
+        screens[name] = screen
+    return {"start": names[0], "screens": screens, "base_dir": path}
+
+
+def synthetic_script(config, templates, size=(1920, 1080), battle_seconds=5.0, tap_delay=0.2, result=0):
+    """根据副本配置生成合成画面的脚本（不需要录制）
+
+    按 stage_graph 编译出的状态机为每个状态生成一个画面：在固定的背景上
+    把该状态的图片贴到不同的位置，点击图片进入下一个状态的画面。
+    战斗画面停留 battle_seconds 秒后出现第 result 种战斗结果；体力不足的提示不会出现。
+    """
+    import numpy as np
+    from stage_graph import compile_stage
+
+    graph = compile_stage(config)
+    width, height = size
+    background = np.random.default_rng(0).integers(20, 60, (height, width, 3), dtype=np.uint8)
+
+    def target(name):
+        # 体力检查没有对应的画面，直接进入下一个状态
+        while name in graph.states and graph.states[name].kind == "energy":
+            name = graph.states[name].next_state
+        return name
+
+    screens = {}
+    for index, state in enumerate(graph.states.values()):
+        if state.kind == "energy":
+            continue
+        frame = background.copy()
+        if state.kind == "battle":
+            frame[:, :, 2] = 90  # 战斗中的画面与其他画面区分开
+            first = state.results[state.templates[min(result, len(state.templates) - 1)]]
+            screens[state.name] = {
+                "frames": [frame],
+                "after": {"seconds": battle_seconds, "next": target(first["next"])}
+            }
+            continue
+
+        image = state.templates[0]
+        cached = templates.get(image)
+        if cached is None:
+            raise ValueError(f"无法读取模板图片: {image}")
+        # 每个状态把图片贴在不同的位置
+        x = (97 * index) % max(1, width - cached.width)
+        y = (61 * index) % max(1, height - cached.height)
+        region = frame[y:y + cached.height, x:x + cached.width]
+        if cached.mask is not None:
+            np.copyto(region, cached.image, where=cached.mask > 0)
+        else:
+            region[...] = cached.image
+        screens[state.name] = {
+            "frames": [frame],
+            "taps": [{"box": [x, y, x + cached.width, y + cached.height],
+                      "next": target(state.next_state), "delay": tap_delay}]
+        }
+    return {"start": graph.start, "screens": screens}
+
+
+class FakeController(MumuController):
+    """模拟设备：实现与 MumuController 相同的接口，不需要模拟器
+
+    截图返回脚本中当前画面的帧，点击按脚本切换画面，所有输入都记录在
+    inputs 中（指定 log_path 时同时按行写入 JSON）。speed 大于 1 时
+    脚本中的时间按比例缩短，capture_delay 模拟截图耗时。
+    """
+
+    def __init__(self, script, templates=None, speed=1.0, capture_delay=0.0, log_path=None, serial="fake"):
+        super().__init__(adb_path="adb", templates=templates, serial=serial)
+        if isinstance(script, str):
+            script = load_script(script)
+        self.script = script
+        self.base_dir = script.get("base_dir", "")
+        self.speed = speed
+        self.capture_delay = capture_delay
+        self.log_path = log_path
+
+        self.inputs = []    # 所有输入 [{"time", "action", ...}]
+        self.screen_name = script["start"]
+        self._entered = time.time()
+        self._pending = None   # 点击后延迟生效的切换 (生效时间, 画面名称)
+        self._frames = {}      # 已加载的图像 {文件名: 图像}
+        self._tap_boxes = {}   # 按图片定义的点击区域 {(画面, 图片): 区域}
+        self._lock = threading.Lock()
+
+    def find_adb(self, adb_path):
+        """模拟设备不需要 adb"""
+        return adb_path
+
+    def _load_frame(self, frame):
+        if not isinstance(frame, str):
+            return frame
+        if frame not in self._frames:
+            import cv2
+            image = cv2.imread(os.path.join(self.base_dir, frame))
+            if image is None:
+                raise ValueError(f"无法读取截图: {frame}")
+            self._frames[frame] = image
+        return self._frames[frame]
+
+    def _switch(self, name, now):
+        if name not in self.script["screens"]:
+            print(f"模拟设备: 画面 {name} 不存在")
+            return
+        self.screen_name = name
+        self._entered = now
+        self._pending = None
+
+    def _advance(self, now):
+        """处理到期的延迟切换和定时切换"""
+        while True:
+            if self._pending is not None and now >= self._pending[0]:
+                self._switch(self._pending[1], self._pending[0])
+                continue
+            after = self.script["screens"][self.screen_name].get("after")
+            if after is not None and self._pending is None:
+                deadline = self._entered + after["seconds"] / self.speed
+                if now >= deadline:
+                    self._switch(after["next"], deadline)
+                    continue
+            return
+
+    def current_frame(self):
+        """当前画面应显示的帧"""
+        with self._lock:
+            now = time.time()
+            self._advance(now)
+            frames = self.script["screens"][self.screen_name]["frames"]
+            elapsed = (now - self._entered) * self.speed
+            current = frames[0]
+            for frame in frames:
+                # 带时间的帧按时间播放，停在最后一帧
+                if isinstance(frame, dict):
+                    if frame["t"] > elapsed:
+                        break
+                    current = frame
+            if isinstance(current, dict):
+                current = current["file"]
+            return self._load_frame(current)
+
+    def capture(self):
+        """返回当前画面的帧"""
+        with metrics.span("capture", device=self.serial):
+            if self.capture_delay > 0:
+                time.sleep(self.capture_delay)
+            frame = self.current_frame()
+        if self.screen_size != (frame.shape[1], frame.shape[0]):
+            self.calibrate(frame.shape[1], frame.shape[0])
+        return frame
+
+    def _tap_box(self, tap):
+        """点击规则对应的区域，None 表示任意位置"""
+        if "box" in tap:
+            return tap["box"]
+        if "image" not in tap:
+            return None
+        key = (self.screen_name, tap["image"])
+        if key not in self._tap_boxes:
+            box = (0, 0, 0, 0)
+            cached = self.templates.get(tap["image"])
+            frames = self.script["screens"][self.screen_name]["frames"]
+            if cached is not None:
+                import matcher
+                frame = frames[0]["file"] if isinstance(frames[0], dict) else frames[0]
+                score, (x, y) = matcher.match_full(self._load_frame(frame), cached)
+                if score >= 0.8:
+                    box = (x, y, x + cached.width, y + cached.height)
+            self._tap_boxes[key] = box
+        return self._tap_boxes[key]
+
+    def _record(self, entry):
+        self.inputs.append(entry)
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def tap(self, x, y):
+        """点击：命中脚本中的点击规则时切换画面"""
+        with self._lock:
+            now = time.time()
+            self._advance(now)
+            target = None
+            for tap in self.script["screens"][self.screen_name].get("taps", []):
+                box = self._tap_box(tap)
+                if box is None or (box[0] <= x < box[2] and box[1] <= y < box[3]):
+                    target = tap
+                    break
+            metrics.inc("taps", device=self.serial)
+            self._record({"time": now, "action": "tap", "x": x, "y": y,
+                          "screen": self.screen_name, "next": target["next"] if target else None})
+            if target is not None:
+                delay = target.get("delay", 0) / self.speed
+                if delay > 0:
+                    self._pending = (now + delay, target["next"])
+                else:
+                    self._switch(target["next"], now)
+
+    def swipe(self, x1, y1, x2, y2, duration=1000):
+        """滑动：只记录，不切换画面"""
+        with self._lock:
+            self._record({"time": time.time(), "action": "swipe", "x1": x1, "y1": y1,
+                          "x2": x2, "y2": y2, "duration": duration, "screen": self.screen_name})
+
+    def run_inputs(self, actions):
+        """依次执行一串输入，动作之间按脚本速度等待"""
+        for action in actions:
+            if action["action"] == "tap":
+                self.tap(action["x"], action["y"])
+            else:
+                self.swipe(action["x1"], action["y1"], action["x2"], action["y2"], action.get("duration", 1000))
+            if action.get("delay", 0) > 0:
+                time.sleep(action["delay"] / self.speed)
+        return True
+
+    def check_devices(self):
+        return True
+
+    def connect_to_mumu(self):
+        return True
+
+    def start_capture_thread(self, size=3, interval=0.5):
+        """模拟设备的截图不需要后台线程"""
+        return None
+
+    def close(self):
+        if self._shared_frame is not None:
+            self._shared_frame.close()
+            self._shared_frame = None
+
+
+def record(controller, out_dir, duration, interval=0.5):
+    """从真实设备录制一段截图，保存为可以回放的文件夹，返回截图数量"""
+    import cv2
+
+    os.makedirs(out_dir, exist_ok=True)
+    timestamps = {}
+    start_time = time.time()
+    while time.time() - start_time < duration:
+        frame_time = time.time()
+        frame = controller.capture()
+        if frame is not None:
+            name = f"{len(timestamps):05d}.png"
+            cv2.imwrite(os.path.join(out_dir, name), frame)
+            timestamps[name] = round(frame_time - start_time, 3)
+        remaining = interval - (time.time() - frame_time)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    with open(os.path.join(out_dir, "frames.json"), "w", encoding="utf-8") as f:
+        json.dump(timestamps, f, ensure_ascii=False, indent=4)
+    return len(timestamps)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "record":
+        print("用法: python fake_device.py record <保存文件夹> [秒数] [设备序列号]")
+        sys.exit(1)
+
+    from game_automation import GameAutomation
+
+    game = GameAutomation(serial=sys.argv[4] if len(sys.argv) > 4 else None)
+    if not game.controller.connect_to_mumu():
+        print("连接模拟器失败，请检查模拟器是否正常运行")
+        sys.exit(1)
+    count = record(game.controller, sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 60)
+    game.controller.close()
+    print(f"已录制 {count} 张截图到 {sys.argv[2]}")
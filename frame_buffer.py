@@ -0,0 +1,117 @@
+import threading
+import time
+
+from metrics import metrics
+
+
+class FrameRing:
+    """预分配的截图环形缓冲区
+
+    截图线程把解码后的图像直接写入预先分配好的数组（不会每帧重新分配内存），
+    读取方按序号获取最新一帧。写入总是使用最新一帧之后的槽位，
+    读取只复制最新一帧，所以两者不会同时访问同一个数组。
+    """
+
+    def __init__(self, size=3):
+        if size < 2:
+            raise ValueError("环形缓冲区至少需要2个槽位")
+        self.size = size
+        self.frames = [None] * size
+        self.seq = 0            # 最新一帧的序号，0 表示还没有截图
+        self.timestamp = 0.0    # 最新一帧的截图时间
+        self._latest = -1
+        self._cond = threading.Condition()
+
+    def begin_write(self, shape, dtype):
+        """获取下一个可写入的槽位，返回 (槽位编号, 数组)
+
+        只有分辨率变化时才会重新分配数组
+        """
+        import numpy as np
+
+        index = (self._latest + 1) % self.size
+        frame = self.frames[index]
+        if frame is None or frame.shape != tuple(shape) or frame.dtype != dtype:
+            frame = np.empty(shape, dtype=dtype)
+            self.frames[index] = frame
+        return index, frame
+
+    def commit(self, index):
+        """写入完成，把该槽位设为最新一帧"""
+        with self._cond:
+            self._latest = index
+            self.seq += 1
+            self.timestamp = time.time()
+            self._cond.notify_all()
+
+    def read(self, after_seq=0, out=None, timeout=None):
+        """等待序号大于 after_seq 的帧，复制到 out（尺寸不符时新建），返回 (序号, 图像)
+
+        超时返回 (after_seq, None)
+        """
+        import numpy as np
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return after_seq, None
+            source = self.frames[self._latest]
+            if out is None or out.shape != source.shape or out.dtype != source.dtype:
+                out = source.copy()
+            else:
+                np.copyto(out, source)
+            return self.seq, out
+
+
+class CaptureThread(threading.Thread):
+    """单台设备的截图线程
+
+    持续截图并写入 FrameRing，截图与模板匹配并行进行；
+    多个读取方（战斗检查、体力检查、调试录制等）共享同一份截图
+    """
+
+    def __init__(self, controller, ring=None, interval=0.5):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.ring = ring or FrameRing()
+        # 两次截图之间的最短间隔（秒），默认与战斗检查的截图间隔相同；
+        # 为 0 时会不停地截图和解码，整局都占满一个 CPU 核心
+        self.interval = interval
+        self.error = None
+        self._stop_event = threading.Event()
+        self._raw = bytearray()
+
+    def run(self):
+        import numpy as np
+
+        while not self._stop_event.is_set():
+            start_time = time.time()
+            data = None
+            try:
+                with metrics.span("screencap", device=self.controller.serial):
+                    size = self.controller.session.exec_out_into("screencap", self._raw)
+                data = memoryview(self._raw)[:size]
+                width, height, _, _ = self.controller.parse_screencap_header(data)
+                index, slot = self.ring.begin_write((height, width, 3), np.uint8)
+                with metrics.span("decode"):
+                    self.controller.decode_screencap(data, out=slot)
+                self.ring.commit(index)
+                self.error = None
+            except Exception as e:
+                if self.error is None:
+                    print(f"截图线程出错: {e}")
+                # 不保留调用栈：栈中的数组会继续引用截图缓冲区
+                self.error = e.with_traceback(None)
+                self._stop_event.wait(1.0)
+                continue
+            finally:
+                # 释放对缓冲区的引用，否则下一次截图需要扩大缓冲区时会出错
+                data = None
+
+            remaining = self.interval - (time.time() - start_time)
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+
+    def stop(self, timeout=2):
+        """停止截图线程"""
+        self._stop_event.set()
+        self.join(timeout)
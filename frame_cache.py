@@ -0,0 +1,67 @@
+import threading
+
+
+class Frame:
+    """一帧截图及由它派生的图像
+
+    同一帧要和多个模板比较时，灰度图、缩小的灰度图、缩略图、画面哈希等
+    只在第一次用到时计算，之后所有匹配器和画面检测直接复用。
+    region() 返回查找区域的子帧，它的灰度图直接从整帧的灰度图中截取。
+    """
+
+    def __init__(self, image, parent=None, roi=None):
+        self.image = image    # BGR 图像
+        self.parent = parent  # region() 生成的子帧对应的整帧
+        self.roi = roi        # 子帧在整帧中的区域 (x1, y1, x2, y2)
+        self._planes = {}
+        self._lock = threading.RLock()
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def cached(self, key, compute):
+        """取出缓存的派生结果，没有时调用 compute() 计算并缓存"""
+        with self._lock:
+            if key not in self._planes:
+                self._planes[key] = compute()
+            return self._planes[key]
+
+    def gray(self):
+        """灰度图"""
+        def compute():
+            if self.parent is not None:
+                x1, y1, x2, y2 = self.roi
+                return self.parent.gray()[y1:y2, x1:x2]
+            if self.image.ndim == 2:
+                return self.image
+            import cv2
+            return cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self.cached("gray", compute)
+
+    def resized_gray(self, size):
+        """缩放到 size (宽, 高) 的灰度图"""
+        def compute():
+            import cv2
+            return cv2.resize(self.gray(), size, interpolation=cv2.INTER_AREA)
+        return self.cached(("resized_gray", tuple(size)), compute)
+
+    def small_gray(self, factor):
+        """按比例缩小的灰度图"""
+        height, width = self.image.shape[:2]
+        return self.resized_gray((max(1, int(round(width * factor))), max(1, int(round(height * factor)))))
+
+    def region(self, roi):
+        """查找区域 (x1, y1, x2, y2) 的子帧
+
+        子帧不缓存在整帧上，避免整帧和子帧互相引用，截图不能及时释放
+        """
+        x1, y1, x2, y2 = roi
+        return Frame(self.image[y1:y2, x1:x2], self, roi)
+
+
+def as_frame(image):
+    """截图转换为 Frame，已经是 Frame 时直接返回"""
+    if image is None or isinstance(image, Frame):
+        return image
+    return Frame(image)
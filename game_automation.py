@@ -3,9 +3,79 @@ import subprocess
 import time
 import json
 import sys
+import struct
+from adb_session import AdbSession, AdbError
+from template_cache import TemplateCache
+import matcher
+from timing_profile import TimingProfile
+from screen_classifier import ScreenClassifier
+from metrics import metrics
+from match_memo import MatchMemo
+from frame_cache import as_frame
 
 class MumuController:
-    def __init__(self, adb_path="adb", mumu_port="7555"):
+    def __init__(self, adb_path="adb", mumu_port="7555", templates=None, serial=None):
+        self.adb_path = self.find_adb(adb_path)
+        
+        self.mumu_port = mumu_port
+        # 指定设备序列号时不再使用 127.0.0.1:端口
+        self._serial = serial
+        
+        # 创建截图文件夹
+        self.screenshots_dir = "screenshots"
+        if not os.path.exists(self.screenshots_dir):
+            os.makedirs(self.screenshots_dir)
+        
+        # 保留的最大截图数量
+        self.max_screenshots = 10
+        
+        # 调试模式：是否把每一帧截图保存到screenshots文件夹
+        self.save_screenshots = False
+        
+        # 与adb server的长连接，首次使用时创建
+        self._session = None
+        
+        # 模板缓存，可由多个控制器共享
+        self.templates = templates if templates is not None else TemplateCache()
+        
+        # 默认匹配方式（full / pyramid）
+        self.match_method = "full"
+        # 当前副本配置中单独指定的匹配方式 {键: 匹配方式} 和查找区域 {键: (x1, y1, x2, y2)}，
+        # 多台设备运行不同副本时各自保存，不写入共享的模板缓存
+        self.match_methods = {}
+        self.rois = {}
+        # 每个模板上一次匹配成功的位置 {键: (x1, y1, x2, y2)}，按本设备的分辨率记录
+        self.learned_rois = {}
+        
+        # 共享的匹配线程池（多模拟器运行时设置），为 None 时在当前线程匹配
+        self.match_executor = None
+        # 多进程匹配（match_pool.ProcessMatchPool），设置后优先使用
+        self.match_pool = None
+        self._shared_frame = None
+        
+        # 匹配结果缓存：画面没有变化时直接返回上一次的结果，设为 None 可关闭
+        self.match_memo = MatchMemo()
+        
+        # 点击方式：input（input tap）或 sendevent（直接写入触摸事件，延迟更低）
+        # sendevent 找不到触摸屏或写入失败时自动改回 input
+        self.input_backend = "input"
+        self.touch_device = None       # sendevent 使用的触摸屏（touch_input.TouchDevice），首次点击时查找
+        self.touch_rotation = None     # 屏幕相对触摸屏自然方向的旋转（0-3），None 时自动判断
+        
+        # 后台截图线程（start_capture_thread 启动）及读取状态
+        self.capture_thread = None
+        self._last_seq = 0
+        self._frame_index = 0
+        self._frame_buffers = [None, None]
+        
+        # 模板图片截取时的分辨率 (宽, 高)，其他分辨率下按比例缩放模板
+        self.template_resolution = (1920, 1080)
+        self.screen_size = None        # 首帧截图得到的当前分辨率 (宽, 高)
+        self.template_scale = None     # 已确定的模板缩放比例
+        self.candidate_scales = [1.0]  # 比例未确定时依次尝试的缩放比例
+        
+    def find_adb(self, adb_path):
+        """在常见的 ADB 安装位置查找 adb 程序，找不到时抛出 FileNotFoundError"""
         # 尝试在常见的 ADB 安装位置查找
         common_adb_paths = [
             adb_path,
@@ -16,38 +86,51 @@ class MumuController:
             os.path.join(os.environ.get('LOCALAPPDATA', ''), r"Android\Sdk\platform-tools\adb.exe")
         ]
         
-        self.adb_path = None
         for path in common_adb_paths:
             if os.path.exists(path):
-                self.adb_path = path
-                break
+                return path
         
-        if self.adb_path is None:
-            print("警告: 未找到adb程序，请确保已经安装ADB并添加到环境变量中")
-            print("您可以：")
-            print("1. 安装 Android SDK 并将 platform-tools 添加到环境变量")
-            print("2. 直接指定 adb.exe 的完整路径，例如：")
-            print(r'controller = MumuController(adb_path="C:\path\to\your\adb.exe")')
-            raise FileNotFoundError("找不到 adb 程序")
+        print("警告: 未找到adb程序，请确保已经安装ADB并添加到环境变量中")
+        print("您可以：")
+        print("1. 安装 Android SDK 并将 platform-tools 添加到环境变量")
+        print("2. 直接指定 adb.exe 的完整路径，例如：")
+        print(r'controller = MumuController(adb_path="C:\path\to\your\adb.exe")')
+        raise FileNotFoundError("找不到 adb 程序")
         
-        self.mumu_port = mumu_port
         
-        # 创建截图文件夹
-        self.screenshots_dir = "screenshots"
-        if not os.path.exists(self.screenshots_dir):
-            os.makedirs(self.screenshots_dir)
+    @property
+    def serial(self):
+        """当前模拟器的设备序列号"""
+        return self._serial or f"127.0.0.1:{self.mumu_port}"
         
-        # 保留的最大截图数量
-        self.max_screenshots = 10
+    @property
+    def session(self):
+        """获取adb长连接会话（ADB路径或端口变化后自动重建）"""
+        if (self._session is None or self._session.serial != self.serial
+                or self._session.adb_path != self.adb_path):
+            if self._session is not None:
+                self._session.close()
+            self._session = AdbSession(self.adb_path, self.serial)
+        return self._session
+        
+    def close(self):
+        """关闭adb长连接"""
+        self.stop_capture_thread()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._shared_frame is not None:
+            self._shared_frame.close()
+            self._shared_frame = None
         
     def check_devices(self):
         """检查已连接的设备"""
         try:
-            cmd = f"{self.adb_path} devices"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            devices = self.session.devices()
             print("当前连接的设备：")
-            print(result.stdout)
-            return "127.0.0.1:" + self.mumu_port in result.stdout
+            for serial, state in devices:
+                print(f"{serial}\t{state}")
+            return any(serial == self.serial and state == "device" for serial, state in devices)
         except Exception as e:
             print(f"检查设备时出错: {e}")
             return False
@@ -56,7 +139,7 @@ class MumuController:
         """连接到MuMu模拟器"""
         try:
             # 确保ADB服务器正在运行
-            subprocess.run([self.adb_path, "start-server"])
+            self.session.start_server()
             
             # 检查是否已经连接
             if self.check_devices():
@@ -64,31 +147,106 @@ class MumuController:
                 return True
             
             # 连接到模拟器
-            connect_cmd = f"{self.adb_path} connect 127.0.0.1:{self.mumu_port}"
-            result = subprocess.run(connect_cmd, shell=True, capture_output=True, text=True)
+            result = self.session.connect(self.serial)
             
-            if "connected" in result.stdout.lower():
+            if "connected" in result.lower():
                 print("成功连接到MuMu模拟器")
                 return True
             else:
                 print("连接失败，请确保MuMu模拟器正在运行")
                 return False
-        except subprocess.SubprocessError as e:
+        except (subprocess.SubprocessError, AdbError) as e:
             print(f"连接过程中出现错误: {e}")
             return False
         except Exception as e:
             print(f"发生未知错误: {e}")
             return False
                 
+    def find_touch_device(self):
+        """通过 getevent -p 查找触摸屏设备，找不到时返回 None"""
+        from touch_input import TouchDevice
+        
+        try:
+            device = TouchDevice.from_getevent(self.session.shell("getevent -p"))
+        except Exception as e:
+            print(f"查找触摸屏设备失败: {e}")
+            return None
+        if device is None:
+            print("没有找到触摸屏设备")
+        else:
+            print(f"触摸屏设备: {device}")
+        return device
+
+    def _use_sendevent(self):
+        """当前是否使用 sendevent 点击，首次使用时查找触摸屏设备"""
+        if self.input_backend != "sendevent" or self.screen_size is None:
+            return False
+        if self.touch_device is None:
+            self.touch_device = self.find_touch_device()
+            if self.touch_device is None:
+                print("改用 input tap 点击")
+                self.input_backend = "input"
+                return False
+        return True
+
     def tap(self, x, y):
         """模拟点击屏幕"""
-        cmd = f"{self.adb_path} -s 127.0.0.1:{self.mumu_port} shell input tap {x} {y}"
-        subprocess.run(cmd, shell=True)
+        try:
+            with metrics.span("tap", device=self.serial, backend=self.input_backend):
+                output = self.session.run(self.input_command({"action": "tap", "x": x, "y": y}))
+            # sendevent 成功时没有输出，有输出说明无法写入触摸屏（例如没有权限）
+            if self.input_backend == "sendevent" and output.strip():
+                print(f"sendevent 点击失败，改用 input tap: {output.strip()}")
+                self.input_backend = "input"
+                self.session.run(f"input tap {x} {y}")
+        except Exception as e:
+            print(f"点击失败: {e}")
         
     def swipe(self, x1, y1, x2, y2, duration=1000):
         """模拟滑动屏幕"""
-        cmd = f"{self.adb_path} -s 127.0.0.1:{self.mumu_port} shell input swipe {x1} {y1} {x2} {y2} {duration}"
-        subprocess.run(cmd, shell=True)
+        try:
+            with metrics.span("swipe", device=self.serial):
+                self.session.run(f"input swipe {x1} {y1} {x2} {y2} {duration}",
+                                 duration / 1000 + self.session.timeout)
+        except Exception as e:
+            print(f"滑动失败: {e}")
+
+    def input_command(self, action):
+        """把一个输入动作转换为设备上执行的 shell 命令"""
+        if action["action"] == "tap":
+            if self._use_sendevent():
+                return self.touch_device.tap_command(action["x"], action["y"], self.screen_size, self.touch_rotation)
+            return f"input tap {action['x']} {action['y']}"
+        if action["action"] == "swipe":
+            return (f"input swipe {action['x1']} {action['y1']} {action['x2']} {action['y2']} "
+                    f"{action.get('duration', 1000)}")
+        raise ValueError(f"未知的输入动作: {action['action']}")
+
+    def run_inputs(self, actions):
+        """把一串点击/滑动作为一个脚本发送到设备执行，整串动作只需要一次往返
+
+        actions: [{"action": "tap", "x": x, "y": y, "delay": 0.5},
+                  {"action": "swipe", "x1": .., "y1": .., "x2": .., "y2": .., "duration": 1000}]
+        delay 为该动作之后在设备上等待的秒数。成功发送时返回 True
+        """
+        commands = []
+        for action in actions:
+            commands.append(self.input_command(action))
+            if action.get("delay", 0) > 0:
+                commands.append(f"sleep {action['delay']:.2f}")
+        # 整串动作在一次调用中执行完，等待时间按设备上的等待总时长放宽，每个动作另加 1 秒
+        timeout = sum(action.get("delay", 0) for action in actions) + len(actions) + self.session.timeout
+        try:
+            with metrics.span("input_batch", device=self.serial):
+                output = self.session.run("; ".join(commands), timeout)
+            if self.input_backend == "sendevent" and output.strip():
+                print(f"sendevent 点击失败，改用 input tap: {output.strip()}")
+                self.input_backend = "input"
+                return False
+            return True
+        except Exception as e:
+            print(f"批量输入失败: {e}")
+            return False
 
     def clean_screenshots(self):
         """清理旧的截图文件"""
@@ -104,74 +262,335 @@ class MumuController:
         except Exception as e:
             print(f"清理截图失败: {e}")
 
-    def screenshot(self):
-        """获取屏幕截图"""
+    def capture_raw(self):
+        """获取 screencap 原始数据（不使用 -p，避免模拟器端的PNG编码）"""
+        return self.session.exec_out("screencap")
+
+    @staticmethod
+    def parse_screencap_header(data):
+        """解析 screencap 原始数据的数据头，返回 (宽, 高, 像素格式, 数据头长度)
+        
+        数据头为小端的 宽、高、像素格式（Android 9 以后还多一个色彩空间字段），
+        后面紧跟每像素4字节的像素数据
+        """
+        if len(data) < 12:
+            raise ValueError(f"截图数据长度异常: {len(data)} 字节")
+        
+        width, height, pixel_format = struct.unpack_from("<III", data, 0)
+        # 1: RGBA_8888, 2: RGBX_8888, 5: BGRA_8888
+        if pixel_format not in (1, 2, 5):
+            raise ValueError(f"不支持的像素格式: {pixel_format}")
+        
+        header_size = len(data) - width * height * 4
+        if header_size not in (12, 16):
+            raise ValueError(f"截图数据长度与分辨率 {width}x{height} 不匹配")
+        return width, height, pixel_format, header_size
+
+    @classmethod
+    def decode_screencap(cls, data, out=None):
+        """把 screencap 原始数据解析为 BGR 格式的图像
+        
+        传入 out 时直接写入该数组（尺寸须为 高x宽x3），避免重新分配内存
+        """
+        import cv2
+        import numpy as np
+        
+        width, height, pixel_format, header_size = cls.parse_screencap_header(data)
+        pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 4, offset=header_size)
+        pixels = pixels.reshape(height, width, 4)
+        code = cv2.COLOR_BGRA2BGR if pixel_format == 5 else cv2.COLOR_RGBA2BGR
+        if out is not None:
+            return cv2.cvtColor(pixels, code, dst=out)
+        return cv2.cvtColor(pixels, code)
+
+    def start_capture_thread(self, size=3, interval=0.5):
+        """启动后台截图线程，之后 capture() 直接从环形缓冲区读取最新截图
+
+        interval 为两次截图之间的最短间隔（秒）
+        """
+        from frame_buffer import CaptureThread, FrameRing
+        
+        if self.capture_thread is None or not self.capture_thread.is_alive():
+            self.capture_thread = CaptureThread(self, FrameRing(size), interval)
+            self.capture_thread.start()
+        return self.capture_thread.ring
+
+    def stop_capture_thread(self):
+        """停止后台截图线程"""
+        if self.capture_thread is not None:
+            self.capture_thread.stop()
+            self.capture_thread = None
+
+    def _read_from_ring(self, timeout=5):
+        """从截图线程读取比上次更新的一帧，两个输出数组交替使用"""
+        ring = self.capture_thread.ring
+        index = self._frame_index = 1 - self._frame_index
+        seq, frame = ring.read(self._last_seq, self._frame_buffers[index], timeout)
+        if frame is None:
+            raise TimeoutError("等待截图线程超时")
+        self._last_seq = seq
+        self._frame_buffers[index] = frame
+        return frame
+
+    def capture(self):
+        """获取屏幕截图，直接返回解码后的图像（不经过磁盘）
+        
+        启动了截图线程时读取最新一帧，返回的数组会在之后第二次调用时被覆盖
+        """
         try:
-            start_time = time.time()
-            
-            # 生成新截图的文件名
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            screenshot_name = f"screen_{timestamp}.png"
-            screenshot_path = os.path.join(self.screenshots_dir, screenshot_name)
+            with metrics.span("capture", device=self.serial):
+                if self.capture_thread is not None and self.capture_thread.is_alive():
+                    frame = self._read_from_ring()
+                else:
+                    with metrics.span("screencap", device=self.serial):
+                        raw = self.capture_raw()
+                    with metrics.span("decode"):
+                        frame = self.decode_screencap(raw)
             
-            # 在模拟器中截图并直接拉取到本地
-            cmd = f"{self.adb_path} -s 127.0.0.1:{self.mumu_port} exec-out screencap -p > {screenshot_path}"
-            subprocess.run(cmd, shell=True)
+            # 分辨率变化（或首次截图）时重新计算模板缩放比例
+            if self.screen_size != (frame.shape[1], frame.shape[0]):
+                self.calibrate(frame.shape[1], frame.shape[0])
             
-            end_time = time.time()
-            print(f"截图耗时: {end_time - start_time:.2f}秒")
+            # 调试模式下保存截图
+            if self.save_screenshots:
+                self.save_frame(frame)
             
-            return screenshot_path
+            return frame
         except Exception as e:
             print(f"截图失败: {e}")
             return None
 
-    def find_image(self, template_path, threshold=0.8):
-        """在屏幕上查找指定图片的位置"""
+    def save_frame(self, frame, name=None):
+        """把图像保存到screenshots文件夹，返回保存路径"""
+        import cv2
+        
+        self.clean_screenshots()
+        if name is None:
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            name = f"screen_{timestamp}_{int(time.time() * 1000) % 1000:03d}.png"
+        screenshot_path = os.path.join(self.screenshots_dir, name)
+        cv2.imwrite(screenshot_path, frame)
+        return screenshot_path
+
+    def screenshot(self):
+        """获取屏幕截图并保存到文件，返回文件路径"""
+        frame = self.capture()
+        if frame is None:
+            return None
         try:
-            import cv2
-            import numpy as np
-            
-            print(f"开始查找图片: {template_path}")
-            start_time = time.time()
+            return self.save_frame(frame)
+        except Exception as e:
+            print(f"保存截图失败: {e}")
+            return None
+
+    def calibrate(self, width, height):
+        """根据当前分辨率计算模板的缩放比例
+        
+        长边和短边的比例一致时直接确定缩放比例；不一致（屏幕宽高比不同）时
+        先记录几个候选比例，查找图片时逐个尝试，首次匹配成功后固定下来
+        """
+        self.screen_size = (width, height)
+        base_long, base_short = max(self.template_resolution), min(self.template_resolution)
+        long_ratio = max(width, height) / base_long
+        short_ratio = min(width, height) / base_short
+        
+        if abs(long_ratio - short_ratio) <= 0.02 * short_ratio:
+            self.template_scale = short_ratio
+            self.candidate_scales = [short_ratio]
+            print(f"屏幕分辨率: {width}x{height}, 模板缩放比例: {short_ratio:.3f}")
+        else:
+            self.template_scale = None
+            self.candidate_scales = sorted({round(short_ratio, 3), round((long_ratio + short_ratio) / 2, 3), round(long_ratio, 3)})
+            print(f"屏幕分辨率: {width}x{height}, 宽高比与模板不同，尝试缩放比例: {self.candidate_scales}")
+
+    def frame_hash(self, screen):
+        """截图内容的哈希，用于匹配结果缓存；未启用缓存时返回 None
+
+        screen 为 Frame 时哈希缓存在帧上，同一帧匹配多个模板时只计算一次
+        """
+        if self.match_memo is None:
+            return None
+        frame = as_frame(screen)
+        return frame.cached("hash", lambda: self.match_memo.frame_hash(frame.image))
+
+    def _memo_key(self, frame_hash, cached, threshold, scale, roi, method):
+        if frame_hash is None:
+            return None
+        return frame_hash, cached.key, cached.mtime, round(scale, 4), roi, threshold, method
+
+    def _match_at_scale(self, frame, cached, threshold, scale):
+        """用指定缩放比例的模板匹配，返回 (匹配度, 中心点坐标)
+
+        副本配置指定了查找区域的模板只在区域内查找；学习到的区域内找不到时再全屏查找
+        """
+        method = self.match_methods.get(cached.key, self.match_method)
+        roi = self.templates.search_region(cached.key, frame.shape, scale, self.rois, self.learned_rois)
+        fallback = cached.key not in self.rois
+        memo_key = self._memo_key(self.frame_hash(frame), cached, threshold, scale, roi, method)
+        result = self.match_memo.get(memo_key) if memo_key is not None else None
+        if result is not None:
+            score, loc = result
+            metrics.inc("match_cache", result="hit")
+        else:
+            with metrics.span("match", template=cached.key, method=method):
+                if roi is not None:
+                    score, loc = matcher.match(frame.region(roi), cached, threshold, method)
+                    loc = (loc[0] + roi[0], loc[1] + roi[1])
+                if roi is None or (score < threshold and fallback):
+                    score, loc = matcher.match(frame, cached, threshold, method)
+                    metrics.inc("full_frame_matches", template=cached.key)
+            if memo_key is not None:
+                self.match_memo.put(memo_key, (score, loc))
+                metrics.inc("match_cache", result="miss")
+        
+        if score >= threshold:
+            self.learned_rois[cached.key] = (loc[0], loc[1], loc[0] + cached.width, loc[1] + cached.height)
+        return score, (loc[0] + cached.width//2, loc[1] + cached.height//2)
+
+    def match_template(self, screen, cached, threshold=0.8):
+        """在截图中匹配单个模板，返回 (匹配度, 中心点坐标)
+        
+        优先在模板的查找区域内匹配，区域内找不到时再全屏查找。
+        同一帧匹配多个模板时传入 Frame，灰度图、缩小图和哈希只计算一次
+        """
+        frame = as_frame(screen)
+        if self.template_scale is not None:
+            return self._match_at_scale(frame, cached.rescaled(self.template_scale), threshold, self.template_scale)
+        
+        # 缩放比例未确定，逐个尝试候选比例
+        best = None
+        for scale in self.candidate_scales:
+            score, pos = self._match_at_scale(frame, cached.rescaled(scale), threshold, scale)
+            if best is None or score > best[0]:
+                best = (score, pos, scale)
+        score, pos, scale = best
+        if score >= threshold:
+            self.template_scale = scale
+            print(f"模板缩放比例校准为: {scale:.3f}")
+        return score, pos
+
+    def match_templates(self, screen, cached_list, threshold=0.8):
+        """在同一张截图上匹配多个模板，返回 [(匹配度, 中心点坐标), ...]
+        
+        设置了多进程匹配且模板缩放比例已确定时交给进程池，
+        否则使用匹配线程池或在当前线程中匹配
+        """
+        frame = as_frame(screen)
+        if self.match_pool is not None and self.template_scale is not None:
+            return self._match_in_pool(frame, cached_list, threshold)
+        if self.match_executor is not None:
+            return list(self.match_executor.map(
+                lambda cached: self.match_template(frame, cached, threshold),
+                cached_list
+            ))
+        return [self.match_template(frame, cached, threshold) for cached in cached_list]
+
+    def _match_in_pool(self, frame, cached_list, threshold):
+        """通过共享内存把截图交给进程池匹配，缓存中已有结果的模板不再提交"""
+        from match_pool import SharedFrame
+        
+        scale = self.template_scale
+        matches = [None] * len(cached_list)
+        jobs, job_indexes, memo_keys = [], [], []
+        for index, cached in enumerate(cached_list):
+            method = self.match_methods.get(cached.key, self.match_method)
+            roi = self.templates.search_region(cached.key, frame.shape, scale, self.rois, self.learned_rois)
+            memo_key = self._memo_key(self.frame_hash(frame), cached.rescaled(scale), threshold, scale, roi, method)
+            if memo_key is not None:
+                matches[index] = self.match_memo.get(memo_key)
+                metrics.inc("match_cache", result="miss" if matches[index] is None else "hit")
+            if matches[index] is None:
+                jobs.append((cached.key, scale, roi, threshold, method, cached.key not in self.rois))
+                job_indexes.append(index)
+                memo_keys.append(memo_key)
+        
+        if jobs:
+            if self._shared_frame is None:
+                self._shared_frame = SharedFrame()
+            self._shared_frame.write(frame.image)
+            with metrics.span("match_pool", device=self.serial):
+                pool_matches = self.match_pool.match_many(self._shared_frame, jobs)
+            for index, memo_key, result in zip(job_indexes, memo_keys, pool_matches):
+                matches[index] = result
+                if memo_key is not None:
+                    self.match_memo.put(memo_key, result)
+        
+        results = []
+        for cached, (score, loc) in zip(cached_list, matches):
+            scaled = cached.rescaled(scale)
+            if score >= threshold:
+                self.learned_rois[cached.key] = (loc[0], loc[1], loc[0] + scaled.width, loc[1] + scaled.height)
+            results.append((score, (loc[0] + scaled.width//2, loc[1] + scaled.height//2)))
+        return results
+
+    def find_image(self, template, threshold=0.8, screen=None):
+        """在屏幕上查找指定图片的位置
+        
+        template 可以是图片编号（如 7）或图片路径（如 "images/7.png"）
+        """
+        return self.find_all([template], threshold, screen).get(template)
+
+    def find_all(self, templates, threshold=0.8, screen=None):
+        """只截一次图，在同一帧上查找多张图片
+        
+        返回 {图片: 中心点坐标}，未找到的图片对应 None。
+        传入 screen 时直接使用这张截图，不再重新截图
+        """
+        results = {template: None for template in templates}
+        try:
+            print(f"开始查找图片: {', '.join(str(t) for t in templates)}")
+            
+            # 从缓存获取模板
+            cached_templates = {}
+            for template in templates:
+                cached = self.templates.get(template)
+                if cached is None:
+                    print(f"无法读取模板图片: {template}")
+                else:
+                    cached_templates[template] = cached
+            if not cached_templates:
+                return results
             
             # 获取屏幕截图
-            screenshot_path = self.screenshot()
-            if not screenshot_path:
-                return None
-            
-            # 读取图片
-            screen = cv2.imread(screenshot_path)
-            template = cv2.imread(template_path)
-            
-            if template is None:
-                print(f"无法读取模板图片: {template_path}")
-                return None
+            if screen is None:
+                screen = self.capture()
+            if screen is None:
+                return results
             
             # 模板匹配
-            result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-            
-            end_time = time.time()
-            print(f"图片查找耗时: {end_time - start_time:.2f}秒, 匹配度: {max_val:.2f}")
-            
-            if max_val >= threshold:
-                # 返回中心点坐标
-                w, h = template.shape[1], template.shape[0]
-                return (max_loc[0] + w//2, max_loc[1] + h//2)
-            return None
+            with metrics.span("find", device=self.serial):
+                matches = self.match_templates(screen, list(cached_templates.values()), threshold)
+            
+            scores = []
+            for template, (score, pos) in zip(cached_templates, matches):
+                scores.append(f"{template}={score:.2f}")
+                if score >= threshold:
+                    results[template] = pos
+            print(f"图片匹配度: {', '.join(scores)}")
+            return results
         except Exception as e:
             print(f"查找图片失败: {e}")
-            return None
+            return results
 
-    def click_image(self, template_path, threshold=0.8):
+    def find_any(self, templates, threshold=0.8, screen=None):
+        """只截一次图，返回第一张找到的图片及其位置，都未找到时返回 (None, None)
+        
+        按 templates 的顺序优先
+        """
+        results = self.find_all(templates, threshold, screen)
+        for template in templates:
+            if results.get(template):
+                return template, results[template]
+        return None, None
+
+    def click_image(self, template, threshold=0.8):
         """点击屏幕上的指定图片"""
-        pos = self.find_image(template_path, threshold)
+        pos = self.find_image(template, threshold)
         if pos:
             print(f"找到图片，点击位置: {pos}")
             self.tap(pos[0], pos[1])
             return True
-        print(f"未找到图片: {template_path}")
+        print(f"未找到图片: {template}")
         return False
 
     def capture_template(self, name, x1, y1, x2, y2):
@@ -180,12 +599,11 @@ class MumuController:
             import cv2
             
             # 先截取整个屏幕
-            screenshot_path = self.screenshot()
-            if not screenshot_path:
+            screen = self.capture()
+            if screen is None:
                 return False
             
-            # 读取并裁剪图片
-            screen = cv2.imread(screenshot_path)
+            # 裁剪图片
             template = screen[y1:y2, x1:x2]
             
             # 确保 images 文件夹存在
@@ -209,89 +627,126 @@ class MumuController:
             print(f"保存模板图片失败: {e}")
             return False
 
+def _load_adb_path():
+    """从配置文件读取ADB路径，无效时使用内置ADB并保存配置"""
+    # 获取配置文件路径
+    try:
+        config_dir = os.path.expanduser("~/.e7auto")
+        print(f"配置目录: {config_dir}")
+        
+        if not os.path.exists(config_dir):
+            print("创建配置目录...")
+            os.makedirs(config_dir)
+            
+        config_file = os.path.join(config_dir, "config.json")
+        print(f"配置文件路径: {config_file}")
+        
+    except Exception as e:
+        print(f"创建配置目录失败: {e}")
+        config_file = "config.json"
+        print(f"使用当前目录的配置文件: {config_file}")
+
+    # 尝试加载配置文件
+    if os.path.exists(config_file):
+        try:
+            print("读取现有配置文件...")
+            with open(config_file, "r") as f:
+                config = json.load(f)
+                saved_path = config.get("adb_path")
+                # 如果是相对路径，转换为绝对路径
+                if saved_path and not os.path.isabs(saved_path):
+                    adb_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), saved_path)
+                else:
+                    adb_path = saved_path
+                # 检查路径是否指向临时目录
+                if adb_path and "\\Temp\\_MEI" in adb_path:
+                    print("检测到临时目录的ADB路径，重置配置")
+                    adb_path = None
+            print(f"已读取ADB路径: {adb_path}")
+        except Exception as e:
+            print(f"读取配置文件失败: {e}")
+            adb_path = None
+    else:
+        print("配置文件不存在，使用默认配置")
+        adb_path = None
+
+    # 如果没有有效的ADB路径，使用默认路径
+    if not adb_path or not os.path.exists(adb_path):
+        print("使用默认ADB路径")
+        # 获取程序运行目录
+        exe_dir = os.path.dirname(os.path.abspath(__file__))
+        if hasattr(sys, '_MEIPASS'):  # 如果是打包后的程序
+            exe_dir = os.path.dirname(sys.executable)
+        
+        # 使用相对于程序运行目录的adb路径
+        adb_path = os.path.join(exe_dir, "adb", "adb.exe")
+        print(f"设置ADB路径为: {adb_path}")
+        
+        # 保存默认配置
+        try:
+            print(f"保存配置到: {config_file}")
+            # 总是保存相对路径
+            save_path = os.path.join("adb", "adb.exe")
+            with open(config_file, "w") as f:
+                json.dump({"adb_path": save_path}, f, indent=2)
+            print("配置保存成功")
+        except Exception as e:
+            print(f"保存配置文件失败: {e}")
+
+    # 检查 ADB 路径是否有效
+    if not os.path.exists(adb_path):
+        raise ValueError(f"ADB路径无效: {adb_path}")
+    return adb_path
+
+
+# 已解析的ADB路径，同一进程内的多个 GameAutomation 共用
+_resolved_adb_path = None
+
+
+def resolve_adb_path(refresh=False):
+    """获取ADB路径，结果在进程内缓存，refresh 为 True 或路径失效时重新解析"""
+    global _resolved_adb_path
+    if refresh or _resolved_adb_path is None or not os.path.exists(_resolved_adb_path):
+        _resolved_adb_path = _load_adb_path()
+    return _resolved_adb_path
+
+
 class GameAutomation:
-    def __init__(self):
-        """初始化游戏自动化控制器"""
+    def __init__(self, adb_path=None, serial=None, templates=None, timing=None, classifier=None, controller=None):
+        """初始化游戏自动化控制器
+        
+        多个模拟器同时运行时可以传入已解析的 adb_path、设备序列号 serial，
+        并共享同一个模板缓存 templates、耗时统计 timing 和画面识别器 classifier；
+        传入 controller 时使用该控制器（例如 fake_device.FakeController）
+        """
         try:
-            # 获取配置文件路径
-            try:
-                config_dir = os.path.expanduser("~/.e7auto")
-                print(f"配置目录: {config_dir}")
-                
-                if not os.path.exists(config_dir):
-                    print("创建配置目录...")
-                    os.makedirs(config_dir)
-                    
-                config_file = os.path.join(config_dir, "config.json")
-                print(f"配置文件路径: {config_file}")
-                
-            except Exception as e:
-                print(f"创建配置目录失败: {e}")
-                config_file = "config.json"
-                print(f"使用当前目录的配置文件: {config_file}")
-
-            # 尝试加载配置文件
-            if os.path.exists(config_file):
-                try:
-                    print("读取现有配置文件...")
-                    with open(config_file, "r") as f:
-                        config = json.load(f)
-                        saved_path = config.get("adb_path")
-                        # 如果是相对路径，转换为绝对路径
-                        if saved_path and not os.path.isabs(saved_path):
-                            self.adb_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), saved_path)
-                        else:
-                            self.adb_path = saved_path
-                        # 检查路径是否指向临时目录
-                        if self.adb_path and "\\Temp\\_MEI" in self.adb_path:
-                            print("检测到临时目录的ADB路径，重置配置")
-                            self.adb_path = None
-                    print(f"已读取ADB路径: {self.adb_path}")
-                except Exception as e:
-                    print(f"读取配置文件失败: {e}")
-                    self.adb_path = None
+            if controller is not None:
+                self.adb_path = controller.adb_path
+            elif adb_path:
+                self.adb_path = adb_path
             else:
-                print("配置文件不存在，使用默认配置")
-                self.adb_path = None
-
-            # 如果没有有效的ADB路径，使用默认路径
-            if not self.adb_path or not os.path.exists(self.adb_path):
-                print("使用默认ADB路径")
-                # 获取程序运行目录
-                exe_dir = os.path.dirname(os.path.abspath(__file__))
-                if hasattr(sys, '_MEIPASS'):  # 如果是打包后的程序
-                    exe_dir = os.path.dirname(sys.executable)
-                
-                # 使用相对于程序运行目录的adb路径
-                self.adb_path = os.path.join(exe_dir, "adb", "adb.exe")
-                print(f"设置ADB路径为: {self.adb_path}")
-                
-                # 保存默认配置
-                try:
-                    print(f"保存配置到: {config_file}")
-                    # 总是保存相对路径
-                    save_path = os.path.join("adb", "adb.exe")
-                    with open(config_file, "w") as f:
-                        json.dump({"adb_path": save_path}, f, indent=2)
-                    print("配置保存成功")
-                except Exception as e:
-                    print(f"保存配置文件失败: {e}")
-
-            # 检查 ADB 路径是否有效
-            if not os.path.exists(self.adb_path):
-                raise ValueError(f"ADB路径无效: {self.adb_path}")
+                self.load_adb_path()
 
             print(f"最终使用的ADB路径: {self.adb_path}")
 
+            # 预先加载模板图片
+            if templates is None:
+                templates = controller.templates if controller is not None else TemplateCache()
+            self.templates = templates
+            
             # 创建控制器
-            self.controller = MumuController(adb_path=self.adb_path)
+            if controller is None:
+                controller = MumuController(adb_path=self.adb_path, templates=self.templates, serial=serial)
+            self.controller = controller
+            self.timing = timing if timing is not None else TimingProfile()  # 各副本步骤的耗时统计
+            # 识别当前画面，用于意外画面的恢复
+            self.classifier = classifier if classifier is not None else ScreenClassifier(self.templates)
             self.max_energy_purchase = 3  # 默认体力购买次数上限
             self.running = True
 
-            self.screen_center = (360, 640)
             self.energy_purchase_count = 0
 
-            print(f"初始化完成，屏幕中心点设置为: {self.screen_center}")
+            print("初始化完成")
             print(f"体力购买上限设置为: {self.max_energy_purchase} 次")
             
             # 清理screenshots文件夹
@@ -305,6 +760,19 @@ class GameAutomation:
         
         self.running = True  # 添加运行状态标志
         
+    def load_adb_path(self):
+        """获取ADB路径（同一进程内只解析一次）"""
+        self.adb_path = resolve_adb_path()
+        return self.adb_path
+
+    @property
+    def screen_center(self):
+        """屏幕中心点（首次截图后按实际分辨率计算）"""
+        if self.controller.screen_size:
+            width, height = self.controller.screen_size
+            return (width // 2, height // 2)
+        return (360, 640)
+        
     def clean_screenshots_folder(self):
         """清理screenshots文件夹中的所有图片"""
         try:
@@ -322,166 +790,23 @@ class GameAutomation:
         """停止所有操作"""
         self.running = False
         
-    def find_image(self, template_path, threshold=0.8):
-        """在屏幕上查找指定图片的位置"""
-        if not self.running:
-            return None
-        return self.controller.find_image(template_path, threshold)
-        
-    def check_and_click(self, image_num, max_retries=3, interval=1.0):
-        """检查并点击指定编号的图片"""
-        for retry in range(max_retries):
-            if not self.running:
-                return False
-            if self.controller.click_image(f"images/{image_num}.png"):
-                return True
-            time.sleep(interval)
-        return False
-    
-    def find_and_enter_stage(self):
-        """找到并进入副本"""
-        print("开始寻找副本...")
-        # 按顺序点击1-6号图片进入副本
-        for i in range(1, 7):
-            if not self.check_and_click(i):
-                print(f"找不到图片 {i}，副本进入失败")
-                return False
-            time.sleep(2)
-        print("成功进入副本")
-        return True
-    
-    def handle_battle(self):
-        """处理战斗过程"""
-        print("开始战斗...")
-        check_count = 0
-        while True:
-            # 每5秒检查一次图片7
-            print("检查图片7...")
-            if self.controller.find_image("images/7.png"):
-                print(f"战斗结束，共检查了 {check_count} 次")
-                self.check_and_click(7)
-                time.sleep(1)
-                self.check_and_click(8)
-                break
-            
-            check_count += 1
-            time.sleep(5)  # 直接等待5秒再检查
-    
-    def handle_energy_check(self):
-        """处理体力不足的情况"""
-        # 检查是否出现图片12（体力不足）
-        if self.controller.find_image("images/12.png"):
-            print(f"发现体力不足提示（当前已购买 {self.energy_purchase_count} 次）")
-            
-            # 检查是否超过购买次数限制
-            if self.energy_purchase_count >= self.max_energy_purchase:
-                print(f"已达到体力购买上限 {self.max_energy_purchase} 次，程序结束")
-                return False
-                
-            # 购买体力
-            print(f"购买体力，第 {self.energy_purchase_count + 1} 次")
-            
-            # 多次尝试点击购买按钮，确保点击成功
-            max_retry = 3
-            for retry in range(max_retry):
-                if self.check_and_click(12):
-                    print(f"点击购买按钮成功，等待确认")
-                    time.sleep(2)  # 等待购买确认界面
-                    
-                    # 这里可能需要点击确认购买的按钮
-                    # 如果有确认购买的图片，可以添加相应的检查和点击
-                    
-                    self.energy_purchase_count += 1
-                    time.sleep(3)  # 等待购买完成和界面刷新
-                    
-                    # 再次点击图片6开始副本
-                    print("重新点击图片6开始副本")
-                    if not self.check_and_click(6):
-                        print("点击图片6失败，重试...")
-                        continue
-                        
-                    return True
-                else:
-                    print(f"第 {retry + 1} 次点击购买按钮失败")
-                    time.sleep(1)
-            
-            print("多次尝试购买体力失败")
-            return False
-                
-        return True
+    def run_auto_battle(self, battle_limit=0):
+        """运行自动战斗
+
+        使用与新建副本相同的默认配置，编译为状态机后由 StageRunner 执行
+        """
+        from stage_graph import default_stage_config
+        from stage_runner import StageRunner
 
-    def handle_stage_end(self):
-        """处理副本结束"""
-        print("检查副本结束状态...")
-        # 检查是否出现图片9
-        if self.controller.find_image("images/9.png"):
-            print("发现图片9")
-            self.check_and_click(9)
-            time.sleep(1)
-            
-        # 检查是否出现图片10
-        if self.controller.find_image("images/10.png"):
-            print("发现图片10")
-            self.check_and_click(10)
-            time.sleep(1)
-            
-        # 检查是否出现图片11（重新开始）
-        if self.controller.find_image("images/11.png"):
-            print("发现图片11，准备重新开始")
-            self.check_and_click(11)
-            time.sleep(2)
-            
-            # 点击图片5
-            print("点击图片5")
-            if not self.check_and_click(5):
-                return False
-            time.sleep(2)
-            
-            # 点击图片6开始新的副本
-            print("点击图片6开始新的副本")
-            if not self.check_and_click(6):
-                return False
-                
-            # 等待足够的时间让体力不足提示显示出来
-            time.sleep(3)  # 增加等待时间
-            
-            # 处理可能的体力不足情况
-            if not self.handle_energy_check():
-                return False
-                
-            return True
-            
-        return False
-    
-    def run_auto_battle(self):
-        """运行自动战斗"""
         try:
             print("开始自动战斗程序")
             print(f"体力购买次数限制: {self.max_energy_purchase}")
-            
+
             # 清理旧的截图
             self.clean_screenshots_folder()
-            
-            # 首次进入副本
-            if not self.find_and_enter_stage():
-                return
-                
-            # 首次检查体力
-            if not self.handle_energy_check():
-                return
-            
-            # 无限循环执行副本
-            while True:
-                # 处理战斗过程
-                self.handle_battle()
-                
-                # 处理副本结束
-                if self.handle_stage_end():
-                    print("重新开始副本")
-                    time.sleep(2)
-                else:
-                    print("未检测到重新开始按钮，继续检查")
-                
+
+            runner = StageRunner(self, default_stage_config("自动战斗"), "自动战斗")
+            runner.run(battle_limit)
         except KeyboardInterrupt:
             print(f"\n程序被用户中断，共购买体力 {self.energy_purchase_count} 次")
         except Exception as e:
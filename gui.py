@@ -3,10 +3,12 @@ from tkinter import ttk, messagebox
 import json
 import os
 from game_automation import GameAutomation
+from adb_session import AdbSession
+from stage_runner import StageRunner
+from stage_graph import default_stage_config
+from log_sink import LogSink, DEBUG
 import threading
-import time
 import sys
-import subprocess
 
 class AutoGameGUI:
     def __init__(self):
@@ -38,6 +40,12 @@ class AutoGameGUI:
         # 加载副本配置
         self.load_configs()
         
+        # 日志先进入队列，由界面线程定时批量显示
+        self.log_sink = LogSink()
+        self.max_log_lines = 1000  # 日志区域最多保留的行数
+        self.log_file = os.path.join("logs", "e7auto.log")
+        self._dropped_reported = 0
+        
         # 创建主框架
         self.main_frame = ttk.Frame(self.root, padding="10")
         self.main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -59,6 +67,7 @@ class AutoGameGUI:
         self.main_frame.columnconfigure(1, weight=1)  # 右侧面板
         
         self.game = None
+        self.runner = None
         self.running = False  # 添加运行状态标志
         
         # 配置根窗口的grid权重
@@ -68,6 +77,9 @@ class AutoGameGUI:
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
+        # 定时显示日志
+        self.root.after(100, self.drain_log)
+        
     def get_resource_path(self, relative_path):
         """获取资源文件的绝对路径"""
         try:
@@ -132,12 +144,31 @@ class AutoGameGUI:
             wrap=tk.WORD
         )
         self.status_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
+        self.status_text.tag_configure(DEBUG, foreground="gray")
         
         # 滚动条
         scrollbar = ttk.Scrollbar(frame, command=self.status_text.yview)
         scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S), pady=5)
         self.status_text['yscrollcommand'] = scrollbar.set
         
+        # 日志选项
+        options = ttk.Frame(frame)
+        options.grid(row=1, column=0, columnspan=2, sticky=tk.W, padx=5)
+        self.show_debug_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options,
+            text="显示调试信息",
+            variable=self.show_debug_var,
+            command=self.update_log_options
+        ).grid(row=0, column=0, padx=(0, 10))
+        self.log_file_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options,
+            text="保存日志到文件",
+            variable=self.log_file_var,
+            command=self.update_log_options
+        ).grid(row=0, column=1)
+        
         # 配置grid权重
         frame.columnconfigure(0, weight=1)
         frame.rowconfigure(0, weight=1)
@@ -240,12 +271,15 @@ class AutoGameGUI:
             selected_port = self.port_options[self.port_var.get()]
             
             # 创建游戏控制器
-            self.game = GameAutomation()
-            # 设置ADB路径和模拟器端口
-            self.game.controller.adb_path = adb_path  # 确保GameAutomation类支持设置adb_path
+            self.runner = None
+            self.game = GameAutomation(adb_path=adb_path)
+            # 设置模拟器端口
             self.game.controller.mumu_port = selected_port
             self.game.max_energy_purchase = energy_limit
             
+            # 记录当前副本名称，用于耗时统计
+            self.current_stage = stage
+            
             # 设置运行状态
             self.running = True
             
@@ -267,156 +301,47 @@ class AutoGameGUI:
             # 获取战斗次数限制
             try:
                 battle_limit = int(self.battle_count_var.get())
-                current_battles = 0
             except ValueError:
                 battle_limit = 0
             
-            self.update_status(f"战斗次数限制: {battle_limit if battle_limit > 0 else '无限'}")
-            
-            # 打印配置内容，帮助调试
-            self.update_status("当前配置:")
-            self.update_status(str(config))
-            
-            # 确保成功连接模拟器
-            if not self.game.controller.connect_to_mumu():
-                self.update_status("连接模拟器失败，请检查模拟器是否正常运行")
-                return
-            
-            self.update_status("开始执行自动化任务")
-            
-            # 检查配置格式
-            if "steps" not in config:
-                self.update_status("错误: 配置格式不正确，缺少 'steps' 字段")
-                return
-            
-            # 首次进入副本
-            if not self.execute_enter_sequence(config):
-                return
-            
-            # 首次检查体力并计入战斗次数
-            current_battles += 1
-            self.update_status(f"开始第 {current_battles} 次战斗")
-            
-            # 无限循环执行副本
-            while self.running:
-                # 检查是否达到战斗次数限制
-                if battle_limit > 0 and current_battles >= battle_limit:
-                    self.update_status(f"已达到战斗次数限制: {battle_limit}")
-                    break
-                
-                if not self.execute_battle_sequence(config):
-                    break
-                
-                if not self.execute_end_sequence(config):
-                    break
-                
-                # 准备下一次战斗
-                current_battles += 1
-                self.update_status(f"开始第 {current_battles} 次战斗")
-            
-        except Exception as e:
-            self.update_status(f"发生错误: {e}")
-            import traceback
-            self.update_status(traceback.format_exc())
+            self.runner = StageRunner(self.game, config, self.current_stage, log=self.update_status)
+            self.runner.run(battle_limit)
         finally:
             self.running = False  # 确保状态被重置
-            self.update_status(f"自动化任务结束，共完成 {current_battles} 次战斗")
         
     def update_status(self, message, debug=False):
-        """更新状态显示
+        """更新状态显示（可从任意线程调用，消息由 drain_log 在界面线程中显示）
         Args:
             message: 状态信息
-            debug: 是否为调试信息，True时不显示
+            debug: 是否为调试信息，未勾选"显示调试信息"时不显示
         """
-        if not debug:  # 只显示非调试信息
-            self.status_text.insert(tk.END, f"{message}\n")
-            self.status_text.see(tk.END)
-        
-    def execute_enter_sequence(self, config):
-        """执行进入副本序列"""
-        for step in config["steps"]:
-            if step["type"] == "enter":
-                self.update_status("开始进入副本...")
-                for action in step["actions"]:
-                    if action["action"] == "click":
-                        if not self.game.check_and_click(action["image"]):
-                            self.update_status(f"点击图片 {action['image']} 失败")
-                            return False
-                        time.sleep(action.get("wait", 1))
-        return True
-        
-    def execute_battle_sequence(self, config):
-        """执行战斗过程"""
-        for step in config["steps"]:
-            if step["type"] == "battle":
-                self.update_status("检查战斗状态...")
-                check_count = 0
-                while self.running:
-                    if not self.running:
-                        return False
-                    
-                    # 检查多个可能的结果
-                    if "images" in step["check"]:
-                        for check_info in step["check"]["images"]:
-                            if self.game.controller.find_image(f"images/{check_info['image']}.png"):
-                                result_type = check_info["type"]
-                                self.update_status(f"战斗{result_type}结束")
-                                
-                                wait_time = check_info.get('wait_after_check', 2)
-                                self.update_status(f"等待 {wait_time} 秒后继续...", debug=True)  # 调试信息
-                                time.sleep(wait_time)
-                                
-                                actions = step["actions"].get(result_type, [])
-                                for action in actions:
-                                    if not self.running:
-                                        return False
-                                    if action["action"] == "click":
-                                        self.game.check_and_click(action["image"])
-                                        time.sleep(action.get("wait", 1))
-                                return True
-                                
-                    # 原有的单图片检查逻辑
-                    elif self.game.controller.find_image(f"images/{step['check']['image']}.png"):
-                        self.update_status("战斗结束")
-                        wait_time = step['check'].get('wait_after_check', 2)
-                        self.update_status(f"等待 {wait_time} 秒后继续...")
-                        time.sleep(wait_time)
-                        
-                        for action in step["actions"]:
-                            if not self.running:
-                                return False
-                            if action["action"] == "click":
-                                self.game.check_and_click(action["image"])
-                                time.sleep(action.get("wait", 1))
-                        return True
-                        
-                    check_count += 1
-                    time.sleep(step["check"].get("interval", 5))
-        return True
-        
-    def execute_end_sequence(self, config):
-        """执行结算和重新开始序列"""
-        for step in config["steps"]:
-            if not self.running:
-                return False
-            
-            if step["type"] in ["end", "restart"]:
-                for action in step["actions"]:
-                    if not self.running:
-                        return False
-                    if action["action"] == "click":
-                        if self.game.controller.find_image(f"images/{action['image']}.png"):
-                            self.update_status(f"点击图片 {action['image']}", debug=True)  # 调试信息
-                            self.game.check_and_click(action["image"])
-                            time.sleep(action.get("wait", 1))
-        
-            elif step["type"] == "energy":
-                if not self.running:
-                    return False
-                if self.game.controller.find_image(f"images/{step['check']['image']}.png"):
-                    if not self.game.handle_energy_check():
-                        return False
-        return True
+        self.log_sink.write(message, debug)
+        
+    def drain_log(self):
+        """把队列中的日志批量显示到日志区域，只保留最近 max_log_lines 行"""
+        try:
+            items = self.log_sink.drain()
+            if self.log_sink.dropped != self._dropped_reported:
+                items.append((None, f"（日志过多，已丢弃 {self.log_sink.dropped - self._dropped_reported} 条）"))
+                self._dropped_reported = self.log_sink.dropped
+            if items:
+                # 一次插入整批文本，调试信息显示为灰色
+                chunks = []
+                for level, text in items:
+                    chunks.extend([text + "\n", (level,) if level == DEBUG else ()])
+                self.status_text.insert(tk.END, *chunks)
+                
+                line_count = int(self.status_text.index("end-1c").split(".")[0])
+                if line_count > self.max_log_lines:
+                    self.status_text.delete("1.0", f"{line_count - self.max_log_lines + 1}.0")
+                self.status_text.see(tk.END)
+        finally:
+            self.root.after(100, self.drain_log)
+        
+    def update_log_options(self):
+        """应用日志显示和保存选项"""
+        self.log_sink.show_debug = self.show_debug_var.get()
+        self.log_sink.set_file(self.log_file if self.log_file_var.get() else None)
         
     def stop_automation(self):
         """停止自动化执行"""
@@ -426,9 +351,11 @@ class AutoGameGUI:
         self.update_status("正在停止任务...")
         self.running = False
         
-        # 停止游戏控制器
+        # 停止游戏控制器，取消正在执行的步骤
         if self.game:
             self.game.stop()
+        if self.runner:
+            self.runner.stop()
         
         try:
             # 等待线程结束
@@ -644,24 +571,21 @@ class AutoGameGUI:
             selected_port = self.port_options[self.port_var.get()]
             
             # 先列出所有连接的设备
-            cmd = f'"{adb_path}" devices'  # 添加引号避免路径空格问题
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            devices = result.stdout.strip().split('\n')[1:]  # 跳过第一行
+            session = AdbSession(adb_path)
+            devices = session.devices()
             
             # 显示检测到的设备
             device_info = "检测到的模拟器实例:\n"
             found_devices = []
             
-            for device in devices:
-                if device.strip():
-                    device_id = device.split()[0]
+            for device_id, state in devices:
+                if device_id:
                     if ':' in device_id:  # 模拟器
                         port = device_id.split(':')[1]
                         # 尝试获取设备信息
                         try:
-                            info_cmd = f"{adb_path} -s {device_id} shell getprop ro.product.model"
-                            info = subprocess.run(info_cmd, shell=True, capture_output=True, text=True)
-                            model = info.stdout.strip() or "未知设备"
+                            info = AdbSession(adb_path, device_id).shell("getprop ro.product.model")
+                            model = info.strip() or "未知设备"
                             device_info += f"端口 {port}: {model}\n"
                             found_devices.append(port)
                         except:
@@ -681,10 +605,9 @@ class AutoGameGUI:
             messagebox.showinfo("模拟器状态", device_info)
             
             # 尝试连接选择的端口
-            cmd = f'"{adb_path}" connect 127.0.0.1:{selected_port}'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            result = session.connect(f"127.0.0.1:{selected_port}")
             
-            if "connected" in result.stdout.lower():
+            if "connected" in result.lower():
                 messagebox.showinfo("成功", f"成功连接到端口 {selected_port} 的模拟器")
             else:
                 messagebox.showerror("错误", f"无法连接到端口 {selected_port} 的模拟器")
@@ -744,6 +667,8 @@ class AutoGameGUI:
             # 清理截图文件夹
             self.clean_screenshots_folder()
             
+            self.log_sink.close()
+            
             # 关闭窗口
             self.root.destroy()
         except Exception as e:
@@ -785,54 +710,8 @@ class StageConfigDialog:
         name = self.name_var.get()
         desc = self.desc_var.get()
         if name:
-            # 使用新的配置格式
-            self.gui.configs[name] = {
-                "description": desc or "新副本",
-                "steps": [
-                    # 进入副本
-                    {
-                        "type": "enter",
-                        "actions": [
-                            {"action": "click", "image": i, "wait": 2}
-                            for i in range(1, 7)
-                        ]
-                    },
-                    # 战斗检查
-                    {
-                        "type": "battle",
-                        "check": {"image": 7, "interval": 5},
-                        "actions": [
-                            {"action": "click", "image": 7, "wait": 1},
-                            {"action": "click", "image": 8, "wait": 1}
-                        ]
-                    },
-                    # 结算
-                    {
-                        "type": "end",
-                        "actions": [
-                            {"action": "click", "image": 9, "wait": 1},
-                            {"action": "click", "image": 10, "wait": 1}
-                        ]
-                    },
-                    # 重新开始
-                    {
-                        "type": "restart",
-                        "actions": [
-                            {"action": "click", "image": 11, "wait": 2},
-                            {"action": "click", "image": 5, "wait": 2},
-                            {"action": "click", "image": 6, "wait": 3}
-                        ]
-                    },
-                    # 体力检查
-                    {
-                        "type": "energy",
-                        "check": {"image": 12},
-                        "actions": [
-                            {"action": "handle_energy"}
-                        ]
-                    }
-                ]
-            }
+            # 使用默认的配置格式
+            self.gui.configs[name] = default_stage_config(desc or "新副本")
             self.gui.save_configs()
             self.gui.stage_combo['values'] = list(self.gui.configs.keys())
             self.top.destroy()
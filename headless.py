@@ -0,0 +1,120 @@
+"""无界面运行副本
+
+    python -m headless 支线33                      # 在所有在线设备上运行支线33
+    python -m headless 龙13 -d 127.0.0.1:7555 -b 10
+    python -m headless 支线33 -a emulator-5556=龙13 --metrics-port 9108
+
+启动时只导入标准库，模板匹配相关的模块在需要时才导入；
+ADB 路径只解析一次，并打印各阶段的启动耗时。
+"""
+import argparse
+import json
+import shutil
+import sys
+import time
+
+_start_time = time.perf_counter()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m headless", description="不启动图形界面，按副本配置运行自动化任务")
+    parser.add_argument("stage", help="副本名称（stage_configs.json 中的键）")
+    parser.add_argument("-d", "--devices", nargs="*", help="设备序列号，不指定时使用所有在线设备")
+    parser.add_argument("-a", "--assign", nargs="*", default=[], metavar="序列号=副本", help="为部分设备指定其他副本")
+    parser.add_argument("-b", "--battles", type=int, default=0, help="每台设备的战斗次数，0 表示无限")
+    parser.add_argument("-e", "--energy", type=int, default=3, help="体力购买上限")
+    parser.add_argument("--adb", help="adb 程序路径，不指定时读取配置文件")
+    parser.add_argument("--configs", default="stage_configs.json", help="副本配置文件")
+    parser.add_argument("--workers", type=int, help="模板匹配的线程数（或进程数）")
+    parser.add_argument("--process-matching", action="store_true", help="使用多进程模板匹配")
+    parser.add_argument("--input", choices=["input", "sendevent"], default="input",
+                        help="点击方式：input tap，或用 sendevent 直接写入触摸事件（延迟更低）")
+    parser.add_argument("--capture-threads", action="store_true", help="每台设备使用后台截图线程")
+    parser.add_argument("--metrics-path", help="定期保存耗时统计的文件")
+    parser.add_argument("--metrics-port", type=int, help="提供 Prometheus 耗时统计的端口")
+    parser.add_argument("--log-file", help="日志文件（按大小轮换）")
+    parser.add_argument("--report-interval", type=float, default=60, help="打印设备状态的间隔（秒）")
+    parser.add_argument("--debug", action="store_true", help="显示调试信息")
+    return parser.parse_args(argv)
+
+
+def resolve_adb(path=None):
+    """确定 adb 路径：命令行参数 > 配置文件 > PATH 中的 adb"""
+    if path:
+        return path
+    from game_automation import resolve_adb_path
+
+    try:
+        return resolve_adb_path()
+    except ValueError:
+        found = shutil.which("adb")
+        if found:
+            return found
+        raise
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    timings = [("导入", time.perf_counter() - _start_time)]
+
+    def mark(name, since):
+        timings.append((name, time.perf_counter() - since))
+        return time.perf_counter()
+
+    step_time = time.perf_counter()
+    with open(args.configs, "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    assignments = dict(item.split("=", 1) for item in args.assign)
+    for stage in [args.stage] + list(assignments.values()):
+        if stage not in configs:
+            print(f"副本配置中没有 {stage}，可用的副本: {', '.join(configs)}")
+            return 1
+    step_time = mark("读取配置", step_time)
+
+    adb_path = resolve_adb(args.adb)
+    step_time = mark("解析ADB路径", step_time)
+
+    # 模板匹配相关的模块（cv2 / numpy）从这里开始才导入
+    from device_pool import DevicePool
+    from log_sink import LogSink
+
+    log_sink = LogSink(show_debug=args.debug, file_path=args.log_file, echo=True)
+    pool = DevicePool(
+        adb_path,
+        configs,
+        default_stage=args.stage,
+        assignments=assignments,
+        match_workers=args.workers,
+        energy_limit=args.energy,
+        battle_limit=args.battles,
+        process_matching=args.process_matching,
+        capture_threads=args.capture_threads,
+        input_backend=args.input,
+        metrics_path=args.metrics_path,
+        metrics_port=args.metrics_port,
+        log=log_sink.write,
+    )
+    step_time = mark("加载模板", step_time)
+
+    started = pool.start(args.devices or None)
+    mark("启动设备", step_time)
+    timings.append(("合计", time.perf_counter() - _start_time))
+    print("启动耗时: " + ", ".join(f"{name} {seconds:.2f}秒" for name, seconds in timings))
+    if not started:
+        print("没有可运行的设备")
+        pool.stop()
+        log_sink.close()
+        return 1
+
+    try:
+        pool.wait(args.report_interval)
+    except KeyboardInterrupt:
+        print("正在停止...")
+    finally:
+        pool.stop()
+        log_sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+DEBUG = "debug"
+INFO = "info"
+
+
+class LogSink:
+    """线程安全的日志收集
+
+    自动化线程调用 write() 只把消息放进有上限的队列，不直接操作界面；
+    界面线程定时调用 drain() 批量取出显示。队列满时丢弃新消息并计数，
+    长时间运行时内存占用保持不变。可选按大小轮换的日志文件。
+    没有界面时（echo 为 True）直接打印，不进入队列。
+    """
+
+    def __init__(self, show_debug=False, max_queue=10000, file_path=None, max_bytes=5 * 1024 * 1024, backup_count=3,
+                 echo=False):
+        self.show_debug = show_debug  # 是否显示调试信息
+        self.echo = echo
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0               # 队列满时丢弃的消息数
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._logger = None
+        self._handler = None
+        self.set_file(file_path)
+
+    def set_file(self, file_path, debug=True):
+        """设置日志文件（None 表示不写文件），debug 为 True 时文件中也记录调试信息"""
+        if self._handler is not None:
+            self._logger.removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+        if not file_path:
+            return
+
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._logger = logging.getLogger(f"e7auto.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.DEBUG if debug else logging.INFO)
+        self._handler = logging.handlers.RotatingFileHandler(
+            file_path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8"
+        )
+        self._handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        self._logger.addHandler(self._handler)
+
+    def write(self, message, debug=False):
+        """记录一条消息（可从任意线程调用），参数与步骤执行器的 log 函数一致"""
+        if self._handler is not None:
+            self._logger.log(logging.DEBUG if debug else logging.INFO, message)
+        if debug and not self.show_debug:
+            return
+        if self.echo:
+            print(message)
+            return
+        try:
+            self._queue.put_nowait((DEBUG if debug else INFO, f"[{time.strftime('%H:%M:%S')}] {message}"))
+        except queue.Full:
+            self.dropped += 1
+
+    __call__ = write
+
+    def drain(self, max_items=500):
+        """取出最多 max_items 条待显示的消息，返回 [(级别, 文本), ...]"""
+        items = []
+        while len(items) < max_items:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def close(self):
+        """关闭日志文件"""
+        self.set_file(None)
@@ -0,0 +1,48 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+
+class MatchMemo:
+    """模板匹配结果的 LRU 缓存
+
+    等待画面变化时经常连续截到内容完全相同的画面，此时直接返回上一次的
+    匹配结果，不再重复执行 matchTemplate。键为 (画面哈希, 模板, 查找区域, 阈值, ...)，
+    画面哈希只取间隔采样的像素和少量整行像素计算，比匹配本身快得多。
+    """
+
+    def __init__(self, max_size=256, stride=4):
+        self.max_size = max_size
+        self.stride = stride  # 计算哈希时的采样间隔（像素）
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def frame_hash(self, frame):
+        """画面内容的快速哈希"""
+        sample = frame[::self.stride, ::self.stride]
+        return frame.shape, zlib.crc32(sample.tobytes()), zlib.adler32(frame[::self.stride * 7 + 1].tobytes())
+
+    def get(self, key):
+        """查找缓存的结果，没有时返回 None"""
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        """保存结果，超过上限时淘汰最久未使用的"""
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
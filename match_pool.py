@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import matcher
+
+# 子进程中的模板缓存，由 _init_worker 创建
+_worker_templates = None
+
+
+def _init_worker(images_dir):
+    """子进程初始化：加载一次模板"""
+    global _worker_templates
+    from template_cache import TemplateCache
+    _worker_templates = TemplateCache(images_dir)
+
+
+def _attach(name):
+    """在子进程中打开共享内存（不让子进程负责释放它）"""
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix":
+        # Python 会把子进程打开的共享内存也登记到 resource_tracker，
+        # 子进程退出时会误删父进程的共享内存，这里取消登记
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _match_job(name, shape, dtype, key, scale, roi, threshold, method, fallback=True):
+    """子进程中执行的匹配任务，返回 (匹配度, 左上角坐标)
+
+    先在 roi 区域内匹配，区域内找不到且 fallback 为 True 时再全图匹配
+    """
+    import numpy as np
+
+    shm = _attach(name)
+    try:
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        cached = _worker_templates.get(key)
+        if cached is None:
+            return -1.0, (0, 0)
+        cached = cached.rescaled(scale)
+
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            score, loc = matcher.match(frame[y1:y2, x1:x2], cached, threshold, method)
+            loc = (loc[0] + x1, loc[1] + y1)
+        if roi is None or (score < threshold and fallback):
+            score, loc = matcher.match(frame, cached, threshold, method)
+        del frame
+        return float(score), (int(loc[0]), int(loc[1]))
+    finally:
+        shm.close()
+
+
+class SharedFrame:
+    """可重复使用的共享内存帧缓冲区
+
+    截图只复制一次到共享内存，子进程直接读取，不需要序列化整张图片
+    """
+
+    def __init__(self):
+        self.shm = None
+        self.shape = None
+        self.dtype = None
+
+    def write(self, frame):
+        """写入一帧，缓冲区不够大时重新分配"""
+        import numpy as np
+
+        if self.shm is None or self.shm.size < frame.nbytes:
+            self.close()
+            self.shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf)
+        view[...] = frame
+        del view
+        self.shape = frame.shape
+        self.dtype = frame.dtype.str
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        """释放共享内存"""
+        if self.shm is not None:
+            self.shm.close()
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = None
+
+
+class ProcessMatchPool:
+    """多进程模板匹配
+
+    子进程启动时各自加载一份模板，之后每次匹配只传递共享内存名称、
+    模板编号和查找区域，进程数默认等于 CPU 核心数
+    """
+
+    def __init__(self, images_dir="images", workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(images_dir,)
+        )
+
+    def match_many(self, shared_frame, jobs):
+        """在共享内存中的同一帧上并行执行多个匹配任务
+
+        jobs 为 [(模板键, 缩放比例, 查找区域或None, 阈值, 匹配方式, 区域内找不到时是否全图匹配), ...]，
+        返回与 jobs 顺序一致的 [(匹配度, 左上角坐标), ...]
+        """
+        futures = [
+            self.executor.submit(_match_job, shared_frame.name, shared_frame.shape, shared_frame.dtype, *job)
+            for job in jobs
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """关闭进程池"""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+
+from frame_cache import Frame, as_frame
+
+# 可选的匹配方式
+#   full:    原图全分辨率 TM_CCOEFF_NORMED 匹配
+#   pyramid: 先在缩小的灰度图上粗匹配，再在候选位置附近用原图精确匹配
+MATCH_METHODS = ("full", "pyramid")
+
+
+def match_full(image, cached):
+    """全分辨率匹配，返回 (匹配度, 左上角坐标)"""
+    import cv2
+
+    if isinstance(image, Frame):
+        image = image.image
+    if cached.mask is not None:
+        result = cv2.matchTemplate(image, cached.image, cv2.TM_CCOEFF_NORMED, mask=cached.mask)
+    else:
+        result = cv2.matchTemplate(image, cached.image, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+    return max_val, max_loc
+
+
+def match_pyramid(image, cached, threshold=0.8, factor=0.25, candidates=3, coarse_margin=0.2):
+    """由粗到精的匹配，返回 (匹配度, 左上角坐标)
+
+    1. 截图和模板都转为灰度并缩小到 factor 倍，粗匹配
+    2. 取粗匹配得分最高的几个位置，在原图上只匹配这些位置附近的小块区域
+    3. 某个候选位置的得分达到 threshold 即提前返回
+
+    image 为 Frame 时缩小的灰度图只计算一次，同一帧的其他模板直接复用
+    """
+    import cv2
+    import numpy as np
+
+    frame = as_frame(image)
+    image = frame.image
+    small_template, small_mask = cached.scaled(factor, gray=True)
+    # 模板缩得太小时粗匹配没有意义，直接全图匹配
+    if min(small_template.shape[:2]) < 8:
+        return match_full(image, cached)
+
+    small_image = frame.small_gray(factor)
+    if small_image.shape[0] < small_template.shape[0] or small_image.shape[1] < small_template.shape[1]:
+        return match_full(image, cached)
+
+    if small_mask is not None:
+        coarse = cv2.matchTemplate(small_image, small_template, cv2.TM_CCOEFF_NORMED, mask=small_mask[:, :, 0])
+    else:
+        coarse = cv2.matchTemplate(small_image, small_template, cv2.TM_CCOEFF_NORMED)
+    coarse = np.nan_to_num(coarse, nan=-1.0)
+
+    # 精确匹配时在候选位置周围留出的像素
+    margin = int(np.ceil(1 / factor)) * 2
+    suppress_w = max(1, small_template.shape[1] // 2)
+    suppress_h = max(1, small_template.shape[0] // 2)
+
+    best_score, best_loc = -1.0, (0, 0)
+    for _ in range(candidates):
+        min_val, peak, min_loc, peak_loc = cv2.minMaxLoc(coarse)
+        # 粗匹配得分太低，后面的候选也不可能匹配
+        if peak < threshold - coarse_margin:
+            break
+
+        # 映射回原图坐标，在附近区域精确匹配
+        x = int(peak_loc[0] / factor)
+        y = int(peak_loc[1] / factor)
+        x1 = max(0, x - margin)
+        y1 = max(0, y - margin)
+        x2 = min(image.shape[1], x + cached.width + margin)
+        y2 = min(image.shape[0], y + cached.height + margin)
+        if x2 - x1 >= cached.width and y2 - y1 >= cached.height:
+            score, loc = match_full(image[y1:y2, x1:x2], cached)
+            if score > best_score:
+                best_score, best_loc = score, (loc[0] + x1, loc[1] + y1)
+            if best_score >= threshold:
+                break
+
+        # 屏蔽这个峰值附近，继续找下一个候选
+        cx, cy = peak_loc
+        coarse[max(0, cy - suppress_h):cy + suppress_h + 1, max(0, cx - suppress_w):cx + suppress_w + 1] = -1.0
+
+    return best_score, best_loc
+
+
+def match(image, cached, threshold=0.8, method="full"):
+    """按指定方式匹配模板，返回 (匹配度, 左上角坐标)"""
+    if method == "pyramid":
+        return match_pyramid(image, cached, threshold)
+    return match_full(image, cached)
+
+
+def compare_methods(frames_dir, images_dir="images", threshold=0.8):
+    """用录制的截图比较各匹配方式的耗时和结果
+
+    frames_dir 中的每张截图都会与所有模板匹配，返回
+    {方式: {"time": 总耗时, "found": 找到次数, "agree": 与 full 结果一致的次数}}
+    """
+    import cv2
+    from template_cache import TemplateCache
+
+    cache = TemplateCache(images_dir)
+    stats = {method: {"time": 0.0, "found": 0, "agree": 0} for method in MATCH_METHODS}
+
+    for name in sorted(os.listdir(frames_dir)):
+        if not name.lower().endswith(".png"):
+            continue
+        frame = cv2.imread(os.path.join(frames_dir, name))
+        if frame is None:
+            continue
+
+        for key in cache.keys():
+            cached = cache.get(key)
+            reference = None
+            for method in MATCH_METHODS:
+                start_time = time.perf_counter()
+                score, loc = match(frame, cached, threshold, method)
+                stats[method]["time"] += time.perf_counter() - start_time
+
+                found = loc if score >= threshold else None
+                if found:
+                    stats[method]["found"] += 1
+                if method == "full":
+                    reference = found
+                # 位置相差 3 像素以内视为一致
+                if (found is None and reference is None) or (
+                        found and reference and abs(found[0] - reference[0]) <= 3
+                        and abs(found[1] - reference[1]) <= 3):
+                    stats[method]["agree"] += 1
+
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python matcher.py <截图文件夹> [模板文件夹]")
+        sys.exit(1)
+
+    results = compare_methods(sys.argv[1], *sys.argv[2:3])
+    for method, stat in results.items():
+        print(f"{method}: 总耗时 {stat['time']:.3f}秒, 找到 {stat['found']} 次, 与full一致 {stat['agree']} 次")
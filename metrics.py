@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认的耗时分桶（秒），覆盖从单次匹配到整场战斗的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """耗时分布：各分桶的计数、总耗时和次数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def quantile(self, q):
+        """按分桶估计 q 分位数（0-1），返回所在分桶的上界"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """轻量的耗时统计
+
+    span() 记录一段代码的耗时，按名称和标签汇总成直方图，inc() 记录计数。
+    结果保存在内存中，可以导出为 JSON 文件、Prometheus 文本格式，
+    或者通过 serve() 启动的 HTTP 服务提供给 Prometheus 抓取。
+    """
+
+    def __init__(self, prefix="e7auto"):
+        self.prefix = prefix
+        self.histograms = {}  # {(名称, 标签): Histogram}
+        self.counters = {}    # {(名称, 标签): 数值}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        """记录一次耗时（秒）"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        """增加计数"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def span(self, name, **labels):
+        """记录 with 语句块的耗时"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def snapshot(self):
+        """当前统计的副本，返回可以序列化为 JSON 的字典"""
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "p50": histogram.quantile(0.5),
+                    "p90": histogram.quantile(0.9),
+                    "buckets": dict(zip(histogram.buckets, histogram.counts)),
+                }
+                for (name, labels), histogram in self.histograms.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ]
+        return {"time": time.time(), "histograms": histograms, "counters": counters}
+
+    @staticmethod
+    def _labels_text(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        escaped = []
+        for key, value in items:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def export_text(self):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        declared = set()
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}_seconds"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} histogram")
+                declared.add(metric)
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append(f"{metric}_bucket{self._labels_text(labels, [('le', bound)])} {total}")
+            lines.append(f"{metric}_bucket{self._labels_text(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{metric}_sum{self._labels_text(labels)} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{self._labels_text(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{self._labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """保存到文件：.json 保存为 JSON，其他扩展名保存为 Prometheus 文本格式"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=4)
+            else:
+                f.write(self.export_text())
+        os.replace(temp_path, path)
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        """在后台线程中启动 HTTP 服务，通过 /metrics 提供 Prometheus 文本格式"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        if self._server is not None:
+            return self._server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.export_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"耗时统计服务已启动: http://{host}:{port}/metrics")
+        return self._server
+
+    def stop_server(self):
+        """停止 HTTP 服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# 全局统计，各模块直接使用
+metrics = Metrics()
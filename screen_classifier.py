@@ -0,0 +1,188 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from frame_cache import Frame, as_frame
+
+
+class ScreenClassifier:
+    """根据一帧截图判断当前所在的游戏画面
+
+    每个已知画面都有一个很小的特征向量（缩小后去均值、归一化的灰度图），
+    两个特征的点积就是它们的相关系数：
+    - 标注过的整屏截图：screens/<画面名称>/*.png，与缩小后的整帧比较；
+    - images 中的模板：在模板上一次出现的位置（各设备分别记录，调用时传入）截取同样大小的区域，
+      缩小后与模板比较，不需要全屏搜索。
+    所有特征在一次计算中比较完，返回得分最高的画面。
+    画面名称为数字时表示对应编号的模板，否则一般是状态机中的状态名称。
+    """
+
+    def __init__(self, templates, screens_dir="screens", size=(32, 18), patch_size=(12, 12),
+                 threshold=0.9, max_captures=5):
+        self.templates = templates        # TemplateCache
+        self.screens_dir = screens_dir
+        self.size = size                  # 整屏特征的尺寸 (宽, 高)
+        self.patch_size = patch_size      # 模板特征的尺寸 (宽, 高)
+        self.threshold = threshold        # 得分低于该值视为无法识别
+        self.max_captures = max_captures  # 每个画面最多保留的运行中学习到的截图数
+
+        self.labels = []      # 整屏特征对应的画面名称
+        self.vectors = None   # 整屏特征矩阵，每行一个特征
+        self._learned = {}    # 运行中学习到的整屏特征 {画面名称: deque}
+        self._template_vectors = {}  # {模板键: (修改时间, 特征)}
+        self._lock = threading.Lock()
+
+        self.load_captures()
+
+    @staticmethod
+    def _label(name):
+        """目录名转换为画面名称，数字表示模板编号"""
+        return int(name) if name.isdigit() else name
+
+    @staticmethod
+    def _normalize(image):
+        """图像转换为去均值、长度为 1 的特征向量"""
+        import numpy as np
+
+        vector = image.astype(np.float32).ravel()
+        vector -= vector.mean()
+        norm = float(np.linalg.norm(vector))
+        if norm < 1e-6:
+            return vector
+        return vector / norm
+
+    def _features(self, image, size):
+        """image 可以是图像或 Frame，Frame 的缩小灰度图会被缓存复用"""
+        return self._normalize(as_frame(image).resized_gray(size))
+
+    def signature(self, frame):
+        """整帧的特征向量"""
+        return self._features(frame, self.size)
+
+    def load_captures(self):
+        """加载 screens 文件夹中标注过的截图"""
+        import cv2
+
+        start_time = time.time()
+        labels, vectors = [], []
+        if os.path.isdir(self.screens_dir):
+            for name in sorted(os.listdir(self.screens_dir)):
+                directory = os.path.join(self.screens_dir, name)
+                if not os.path.isdir(directory):
+                    continue
+                for filename in sorted(os.listdir(directory)):
+                    if not filename.lower().endswith(".png"):
+                        continue
+                    frame = cv2.imread(os.path.join(directory, filename))
+                    if frame is None:
+                        print(f"无法读取截图: {os.path.join(directory, filename)}")
+                        continue
+                    labels.append(self._label(name))
+                    vectors.append(self.signature(frame))
+
+        with self._lock:
+            self.labels = labels
+            self.vectors = self._stack(vectors)
+        if labels:
+            print(f"已加载 {len(labels)} 张画面截图，耗时: {time.time() - start_time:.2f}秒")
+
+    @staticmethod
+    def _stack(vectors):
+        import numpy as np
+
+        return np.stack(vectors) if vectors else None
+
+    def add_capture(self, label, frame, save=False):
+        """记住一帧截图对应的画面，save 为 True 时同时保存到 screens 文件夹"""
+        vector = self.signature(frame)
+        with self._lock:
+            # 运行中学习到的截图有数量上限，超出时丢弃最早的一张
+            if label not in self._learned:
+                self._learned[label] = deque(maxlen=self.max_captures)
+            self._learned[label].append(vector)
+
+        if save:
+            import cv2
+
+            directory = os.path.join(self.screens_dir, str(label))
+            os.makedirs(directory, exist_ok=True)
+            image = frame.image if isinstance(frame, Frame) else frame
+            cv2.imwrite(os.path.join(directory, f"{int(time.time() * 1000)}.png"), image)
+
+    def _template_vector(self, key):
+        cached = self.templates.get(key)
+        if cached is None:
+            return None
+        entry = self._template_vectors.get(key)
+        if entry is None or entry[0] != cached.mtime:
+            entry = (cached.mtime, self._features(cached.gray, self.patch_size))
+            self._template_vectors[key] = entry
+        return entry[1]
+
+    def scores(self, frame, learned_rois=None):
+        """计算当前帧与所有已知画面的得分，返回 {画面名称: 得分}
+
+        learned_rois 为截取这一帧的设备上各模板上一次出现的位置 {模板键: (x1, y1, x2, y2)}
+        """
+        results = {}
+        frame = as_frame(frame)
+
+        with self._lock:
+            labels = list(self.labels)
+            rows = [] if self.vectors is None else list(self.vectors)
+            for label, learned in self._learned.items():
+                labels.extend([label] * len(learned))
+                rows.extend(learned)
+        vectors = self._stack(rows)
+        if vectors is not None:
+            # 一次矩阵运算比较所有整屏特征，同一画面取最高分
+            for label, score in zip(labels, vectors @ self.signature(frame)):
+                if score > results.get(label, -1.0):
+                    results[label] = float(score)
+
+        # 模板只在上一次出现的位置比较
+        frame_height, frame_width = frame.shape[:2]
+        for key, box in list((learned_rois or {}).items()):
+            x1, y1, x2, y2 = box
+            if x2 > frame_width or y2 > frame_height or x2 <= x1 or y2 <= y1:
+                continue
+            vector = self._template_vector(key)
+            if vector is None:
+                continue
+            score = float(self._features(frame.region(box), self.patch_size) @ vector)
+            if score > results.get(key, -1.0):
+                results[key] = score
+        return results
+
+    def classify(self, frame, learned_rois=None):
+        """识别当前画面，返回 (画面名称, 得分)，无法识别时画面名称为 None"""
+        results = self.scores(frame, learned_rois)
+        if not results:
+            return None, 0.0
+        label = max(results, key=results.get)
+        if results[label] < self.threshold:
+            return None, results[label]
+        return label, results[label]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python screen_classifier.py <截图文件夹> [画面截图文件夹]")
+        sys.exit(1)
+
+    import cv2
+    from template_cache import TemplateCache
+
+    classifier = ScreenClassifier(TemplateCache(), *sys.argv[2:3])
+    for name in sorted(os.listdir(sys.argv[1])):
+        if not name.lower().endswith(".png"):
+            continue
+        frame = cv2.imread(os.path.join(sys.argv[1], name))
+        if frame is None:
+            continue
+        start_time = time.perf_counter()
+        label, score = classifier.classify(frame)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        print(f"{name}: {label if label is not None else '未知'} ({score:.2f}), 耗时 {elapsed:.1f}毫秒")
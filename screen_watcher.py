@@ -0,0 +1,49 @@
+from frame_cache import as_frame
+
+
+class ScreenWatcher:
+    """画面变化检测
+
+    把每帧截图缩小成很小的灰度图，通过与上一帧的平均差值判断画面是否在变化。
+    画面从变化转为静止（连续几帧没有变化）时认为"画面已稳定"，
+    这时才值得做一次完整的模板匹配。
+    """
+
+    def __init__(self, size=(64, 36), change_threshold=6.0, stable_frames=2):
+        self.size = size                          # 缩略图尺寸 (宽, 高)
+        self.change_threshold = change_threshold  # 平均像素差超过该值视为画面变化
+        self.stable_frames = stable_frames        # 连续多少帧不变视为稳定
+
+        self._previous = None
+        self._still_count = 0
+        self._changed_since_check = True
+
+    def thumbnail(self, frame):
+        """生成用于比较的缩略图（frame 为 Frame 时与匹配共用灰度图）"""
+        return as_frame(frame).resized_gray(self.size)
+
+    def difference(self, a, b):
+        """两张缩略图的平均像素差"""
+        import cv2
+
+        return float(cv2.absdiff(a, b).mean())
+
+    @property
+    def changing(self):
+        """最近一帧是否与上一帧不同（画面正在变化）"""
+        return self._previous is not None and self._still_count == 0
+
+    def update(self, frame):
+        """用新的一帧更新状态，返回画面是否刚刚稳定下来"""
+        thumb = self.thumbnail(frame)
+        if self._previous is not None and self.difference(thumb, self._previous) > self.change_threshold:
+            self._still_count = 0
+            self._changed_since_check = True
+        else:
+            self._still_count += 1
+        self._previous = thumb
+
+        if self._changed_since_check and self._still_count >= self.stable_frames:
+            self._changed_since_check = False
+            return True
+        return False
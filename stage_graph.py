@@ -0,0 +1,215 @@
+def default_stage_config(description="新副本"):
+    """新副本的默认配置（与原来固定流程的点击顺序一致）"""
+    return {
+        "description": description,
+        "steps": [
+            # 进入副本
+            {
+                "type": "enter",
+                "actions": [
+                    {"action": "click", "image": i, "wait": 2}
+                    for i in range(1, 7)
+                ]
+            },
+            # 战斗检查
+            {
+                "type": "battle",
+                "check": {"image": 7, "interval": 5},
+                "actions": [
+                    {"action": "click", "image": 7, "wait": 1},
+                    {"action": "click", "image": 8, "wait": 1}
+                ]
+            },
+            # 结算
+            {
+                "type": "end",
+                "actions": [
+                    {"action": "click", "image": 9, "wait": 1},
+                    {"action": "click", "image": 10, "wait": 1}
+                ]
+            },
+            # 重新开始
+            {
+                "type": "restart",
+                "actions": [
+                    {"action": "click", "image": 11, "wait": 2},
+                    {"action": "click", "image": 5, "wait": 2},
+                    {"action": "click", "image": 6, "wait": 3}
+                ]
+            },
+            # 体力检查
+            {
+                "type": "energy",
+                "check": {"image": 12},
+                "actions": [
+                    {"action": "handle_energy"}
+                ]
+            }
+        ]
+    }
+
+
+class StageState:
+    """状态机中的一个状态：一个画面，以及在该画面上要执行的动作
+
+    kind:
+        click:          等待图片出现并点击（required 为 False 时找不到就跳过）
+        optional_click: 当前画面上有这张图片就点击，没有就跳过
+        battle:         等待战斗结果图片，按结果跳转到不同的状态
+        energy:         出现体力不足提示时购买体力
+    """
+
+    def __init__(self, name, kind, templates, phase, wait=1, required=True, next_state=None):
+        self.name = name
+        self.kind = kind
+        self.templates = list(templates)  # 该状态需要检查的图片
+        self.phase = phase                # enter / battle / end
+        self.wait = wait                  # 动作后的最长等待时间
+        self.required = required
+        self.next_state = next_state      # 下一个状态名称
+        self.restarts = False             # 执行后会开始下一次战斗（重新开始的点击、购买体力）
+
+        # 战斗状态专用
+        self.interval = 5
+        self.timeout = 600  # 等待战斗结果的最长秒数
+        self.results = {}  # {图片: {"type": 结果类型, "wait_after_check": 秒, "next": 状态名称}}
+        self.energy = None  # 等待战斗结果时出现体力不足提示，跳转到的体力检查状态
+
+    def __repr__(self):
+        return f"StageState({self.name}, {self.kind}, {self.templates})"
+
+
+class StageGraph:
+    """由副本配置编译得到的状态机
+
+    enter 步骤的点击依次连接，经过体力检查后进入 battle 状态；battle 按结果分支到
+    各自的点击序列，之后进入 end / restart / energy 组成的结算序列，
+    结算完成后回到 battle 状态开始下一次战斗。
+    """
+
+    BATTLE = "battle"
+
+    def __init__(self):
+        self.states = {}
+        self.start = None
+
+    def add(self, state):
+        self.states[state.name] = state
+        return state
+
+    def all_templates(self):
+        """状态机中出现的所有图片（保持顺序，不重复）"""
+        templates = []
+        for state in self.states.values():
+            for template in state.templates:
+                if template not in templates:
+                    templates.append(template)
+        return templates
+
+    def recovery_order(self):
+        """意外画面恢复时检查状态的顺序：战斗、结算、进入副本"""
+        phases = {"battle": 0, "end": 1, "enter": 2}
+        return sorted(self.states.values(), key=lambda state: phases.get(state.phase, 3))
+
+    def resolve(self, label):
+        """画面识别结果（状态名称或图片编号）转换为状态名称，无法对应时返回 None"""
+        if label is None:
+            return None
+        if label in self.states:
+            return label
+        return self.locate([label])
+
+    def locate(self, found_templates):
+        """根据当前画面上找到的图片，返回最可能对应的状态名称"""
+        for state in self.recovery_order():
+            if state.kind == "energy":
+                continue
+            if any(template in found_templates for template in state.templates):
+                return state.name
+        return None
+
+
+def _chain(graph, prefix, actions, kind, phase, required, next_state, restart_images=()):
+    """把一串点击动作编译成依次连接的状态，返回第一个状态的名称
+
+    restart_images 中的图片点击后会开始下一次战斗，对应的状态标记为 restarts
+    """
+    clicks = [action for action in actions if action.get("action") == "click"]
+    names = [f"{prefix}.{index}" for index in range(len(clicks))]
+    for index, action in enumerate(clicks):
+        following = names[index + 1] if index + 1 < len(names) else next_state
+        state = graph.add(StageState(names[index], kind, [action["image"]], phase,
+                                     action.get("wait", 1), required, following))
+        state.restarts = action["image"] in restart_images
+    return names[0] if names else next_state
+
+
+def compile_stage(config):
+    """把一个副本配置编译为 StageGraph"""
+    graph = StageGraph()
+    steps = config["steps"]
+
+    # 结算序列：end / restart 中的点击是可选的，energy 检查体力
+    end_states = []
+    for index, step in enumerate(steps):
+        if step["type"] in ("end", "restart"):
+            for action_index, action in enumerate(step["actions"]):
+                if action.get("action") == "click":
+                    state = StageState(f"{step['type']}{index}.{action_index}", "optional_click",
+                                       [action["image"]], "end", action.get("wait", 1), False)
+                    state.restarts = step["type"] == "restart"
+                    end_states.append(state)
+        elif step["type"] == "energy":
+            state = StageState(f"energy{index}", "energy", [step["check"]["image"]], "end")
+            state.restarts = True
+            end_states.append(state)
+    for index, state in enumerate(end_states):
+        state.next_state = end_states[index + 1].name if index + 1 < len(end_states) else StageGraph.BATTLE
+        graph.add(state)
+    end_start = end_states[0].name if end_states else StageGraph.BATTLE
+
+    # 重新开始步骤中的图片：战斗结果的点击中出现这些图片（例如失败后直接再次挑战）时，
+    # 同样会开始下一次战斗
+    restart_images = {action["image"] for step in steps if step["type"] == "restart"
+                      for action in step["actions"] if action.get("action") == "click"}
+
+    # 战斗状态：按结果分支
+    battle_step = next((step for step in steps if step["type"] == "battle"), None)
+    energy_step = next((step for step in steps if step["type"] == "energy"), None)
+    energy = None
+    if battle_step is not None and energy_step is not None:
+        # 进入副本的最后一次点击同样可能弹出体力不足提示，检查后再进入战斗；
+        # 等待战斗结果时出现提示也跳转到这里（属于进入副本阶段，不计入结算耗时）
+        state = graph.add(StageState("enter.energy", "energy", [energy_step["check"]["image"]], "enter",
+                                     next_state=StageGraph.BATTLE))
+        state.restarts = True
+        energy = state.name
+    if battle_step is not None:
+        check = battle_step["check"]
+        battle = graph.add(StageState(StageGraph.BATTLE, "battle", [], "battle"))
+        battle.interval = check.get("interval", 5)
+        battle.timeout = check.get("timeout", 600)
+        battle.energy = energy
+        check_infos = check["images"] if "images" in check else [check]
+        for check_info in check_infos:
+            result_type = check_info.get("type", "")
+            if "images" in check:
+                actions = battle_step["actions"].get(result_type, [])
+            else:
+                actions = battle_step["actions"]
+            prefix = f"battle.{result_type or check_info['image']}"
+            battle.templates.append(check_info["image"])
+            battle.results[check_info["image"]] = {
+                "type": result_type,
+                "wait_after_check": check_info.get("wait_after_check", 2),
+                "next": _chain(graph, prefix, actions, "click", "battle", False, end_start, restart_images),
+            }
+
+    # 进入副本：必须依次点击成功
+    enter_actions = []
+    for step in steps:
+        if step["type"] == "enter":
+            enter_actions.extend(step["actions"])
+    after_enter = (energy or StageGraph.BATTLE) if battle_step is not None else end_start
+    graph.start = _chain(graph, "enter", enter_actions, "click", "enter", True, after_enter)
+    return graph
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+from async_runner import AsyncStageRunner, print_log
+
+
+class StageRunner:
+    """按副本配置（stage_configs.json 中的一项）执行自动化步骤
+
+    在当前线程中运行 AsyncStageRunner 的事件循环，供图形界面等线程式调用使用；
+    stop() 可以从其他线程调用，会立即取消正在执行的步骤
+    """
+
+    def __init__(self, game, config, stage_name="", log=None):
+        self.game = game
+        self.runner = AsyncStageRunner(game, config, stage_name, log or print_log)
+
+        self._loop = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    @property
+    def stage_name(self):
+        return self.runner.stage_name
+
+    @property
+    def battles(self):
+        return self.runner.battles
+
+    @property
+    def state(self):
+        return self.runner.state
+
+    def run(self, battle_limit=0):
+        """执行副本，battle_limit 为 0 时无限循环，返回完成的战斗次数"""
+        loop = asyncio.new_event_loop()
+        with self._lock:
+            # 启动前已经被停止
+            if not self.game.running:
+                loop.close()
+                return self.battles
+            self._loop = loop
+            self._task = loop.create_task(self.runner.run(battle_limit))
+        try:
+            return loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            return self.battles
+        finally:
+            with self._lock:
+                self._loop = None
+                self._task = None
+            loop.close()
+
+    def stop(self):
+        """停止执行（可从其他线程调用）"""
+        self.game.stop()
+        with self._lock:
+            if self._loop is not None and self._task is not None:
+                self._loop.call_soon_threadsafe(self._task.cancel)
@@ -0,0 +1,211 @@
+import os
+import time
+
+
+class Template:
+    """一张已解码的模板图片及其预处理结果"""
+
+    def __init__(self, key, path, image, mask=None, mtime=None):
+        self.key = key
+        self.path = path
+        self.image = image  # BGR 图像
+        self.mask = mask    # 透明通道生成的掩码，没有透明区域时为 None
+        self.height, self.width = image.shape[:2]
+        self.mtime = mtime if mtime is not None else os.path.getmtime(path)
+
+        self._gray = None
+        self._scaled = {}
+        self._rescaled = {}
+
+    @property
+    def size(self):
+        """模板尺寸 (宽, 高)"""
+        return self.width, self.height
+
+    @property
+    def gray(self):
+        """灰度版本（首次使用时生成）"""
+        if self._gray is None:
+            import cv2
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def scaled(self, factor, gray=False):
+        """按比例缩放后的版本，返回 (图像, 掩码)，结果会被缓存"""
+        cache_key = (round(factor, 4), gray)
+        if cache_key not in self._scaled:
+            import cv2
+            source = self.gray if gray else self.image
+            if factor == 1:
+                self._scaled[cache_key] = (source, self.mask)
+            else:
+                width = max(1, int(round(self.width * factor)))
+                height = max(1, int(round(self.height * factor)))
+                image = cv2.resize(source, (width, height), interpolation=cv2.INTER_AREA)
+                mask = None
+                if self.mask is not None:
+                    mask = cv2.resize(self.mask, (width, height), interpolation=cv2.INTER_NEAREST)
+                self._scaled[cache_key] = (image, mask)
+        return self._scaled[cache_key]
+
+    def rescaled(self, factor):
+        """适配其他分辨率的模板（整体缩放后的 Template），结果会被缓存"""
+        factor = round(factor, 4)
+        if factor == 1:
+            return self
+        if factor not in self._rescaled:
+            image, mask = self.scaled(factor)
+            self._rescaled[factor] = Template(self.key, self.path, image, mask, self.mtime)
+        return self._rescaled[factor]
+
+
+class TemplateCache:
+    """模板图片缓存
+
+    启动时一次性读取 images 文件夹中的所有模板，之后按图片编号取用，
+    查找图片时不再读取磁盘。模板文件被修改后会自动重新加载。
+
+    副本配置中指定的查找区域和匹配方式属于各自的副本，根据上一次匹配
+    成功的位置学习到的查找区域属于各自的设备（分辨率可能不同），
+    都由使用它们的控制器保存，查找时传入，不写入共享的缓存。
+    """
+
+    def __init__(self, images_dir="images", check_interval=2.0, roi_padding=40):
+        self.images_dir = images_dir
+        self.check_interval = check_interval  # 检查文件是否变化的最小间隔（秒）
+        self.roi_padding = roi_padding        # 查找区域向外扩展的像素数
+        self.templates = {}
+        self._last_check = {}
+        self.load_time = 0.0
+
+        self.load_all()
+
+    def load_all(self):
+        """加载 images 文件夹中的全部模板"""
+        start_time = time.time()
+        self.templates = {}
+        if os.path.isdir(self.images_dir):
+            for name in sorted(os.listdir(self.images_dir)):
+                if name.lower().endswith(".png"):
+                    path = os.path.join(self.images_dir, name)
+                    try:
+                        self._load(self.resolve_key(path), path)
+                    except Exception as e:
+                        print(f"加载模板失败 {path}: {e}")
+        self.load_time = time.time() - start_time
+        print(f"已加载 {len(self.templates)} 张模板图片，耗时: {self.load_time:.2f}秒")
+
+    def _load(self, key, path):
+        import cv2
+
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"无法读取模板图片: {path}")
+
+        mask = None
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            alpha = image[:, :, 3]
+            # 只有存在透明区域时才使用掩码
+            if alpha.min() < 255:
+                mask = cv2.merge([alpha, alpha, alpha])
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+        template = Template(key, path, image, mask)
+        self.templates[key] = template
+        self._last_check[key] = time.time()
+        return template
+
+    def resolve_key(self, template):
+        """把图片编号或图片路径转换为缓存的键
+
+        "images/7.png"、7、"7" 都对应编号 7
+        """
+        if isinstance(template, int):
+            return template
+        template = str(template)
+        if template.isdigit():
+            return int(template)
+        directory, name = os.path.split(template)
+        stem, _ = os.path.splitext(name)
+        if stem.isdigit() and os.path.abspath(directory or ".") == os.path.abspath(self.images_dir):
+            return int(stem)
+        return os.path.abspath(template)
+
+    def path_for(self, key):
+        """获取键对应的图片路径"""
+        if isinstance(key, int):
+            return os.path.join(self.images_dir, f"{key}.png")
+        return key
+
+    def get(self, template):
+        """按图片编号（或路径）获取模板，找不到时返回 None"""
+        key = self.resolve_key(template)
+        cached = self.templates.get(key)
+        path = self.path_for(key)
+
+        if cached is not None:
+            # 控制检查频率，避免每次查找都访问磁盘
+            now = time.time()
+            if now - self._last_check.get(key, 0) < self.check_interval:
+                return cached
+            self._last_check[key] = now
+            try:
+                if os.path.getmtime(path) == cached.mtime:
+                    return cached
+            except OSError:
+                return cached
+            print(f"模板文件已变化，重新加载: {path}")
+
+        if not os.path.exists(path):
+            return None
+        try:
+            return self._load(key, path)
+        except Exception as e:
+            print(f"加载模板失败 {path}: {e}")
+            return None
+
+    def parse_rois(self, rois):
+        """转换配置中的查找区域 {图片编号: [x1, y1, x2, y2]}，返回 {键: (x1, y1, x2, y2)}"""
+        return {self.resolve_key(template): tuple(int(v) for v in box) for template, box in (rois or {}).items()}
+
+    def parse_match_methods(self, methods):
+        """转换配置中单独指定的匹配方式 {图片编号: "full" / "pyramid"}，返回 {键: 匹配方式}"""
+        return {self.resolve_key(template): method for template, method in (methods or {}).items()}
+
+    def search_region(self, key, frame_shape, scale=1.0, rois=None, learned=None):
+        """获取模板在截图中的查找区域（已扩展边距并限制在画面内）
+
+        rois 为副本配置中的区域（parse_rois 的结果），优先于 learned 中
+        学习到的位置（控制器记录的上一次匹配位置，已是当前分辨率的坐标）；
+        配置中的区域按模板分辨率填写，会乘以 scale 换算到当前分辨率。
+        没有可用区域时返回 None，表示需要全屏查找
+        """
+        box = (rois or {}).get(key)
+        if box is not None:
+            box = tuple(int(v * scale) for v in box)
+        else:
+            box = (learned or {}).get(key)
+        if box is None:
+            return None
+
+        template = self.templates.get(key)
+        if template is not None:
+            template = template.rescaled(scale)
+        frame_height, frame_width = frame_shape[:2]
+        x1 = max(0, box[0] - self.roi_padding)
+        y1 = max(0, box[1] - self.roi_padding)
+        x2 = min(frame_width, box[2] + self.roi_padding)
+        y2 = min(frame_height, box[3] + self.roi_padding)
+
+        # 区域必须能容纳整个模板
+        if template is not None and (x2 - x1 < template.width or y2 - y1 < template.height):
+            return None
+        if x2 - x1 >= frame_width and y2 - y1 >= frame_height:
+            return None
+        return x1, y1, x2, y2
+
+    def keys(self):
+        """所有已加载模板的键"""
+        return list(self.templates.keys())
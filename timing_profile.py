@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+
+class TimingProfile:
+    """副本各步骤的耗时统计
+
+    每次执行步骤后记录耗时，保存到本地文件。同一副本的战斗时长很稳定，
+    据此可以推迟第一次检查，并只在预计结束的时间段内频繁检查。
+    """
+
+    def __init__(self, path=None, max_samples=50, min_samples=3):
+        if path is None:
+            path = os.path.join(os.path.expanduser("~/.e7auto"), "timing_stats.json")
+        self.path = path
+        self.max_samples = max_samples  # 每个步骤保留的最近记录数
+        self.min_samples = min_samples  # 至少有多少条记录才使用统计结果
+        self.stats = {}
+        self._lock = threading.Lock()  # 多台模拟器共享同一份统计
+        self.load()
+
+    def load(self):
+        """读取统计文件"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.stats = json.load(f)
+        except Exception as e:
+            print(f"读取耗时统计失败: {e}")
+            self.stats = {}
+
+    def save(self):
+        """保存统计文件"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存耗时统计失败: {e}")
+
+    def record(self, stage, step, duration):
+        """记录一次步骤耗时（秒）"""
+        with self._lock:
+            samples = self.stats.setdefault(stage, {}).setdefault(step, [])
+            samples.append(round(duration, 2))
+            del samples[:-self.max_samples]
+            self.save()
+
+    def percentile(self, stage, step, q):
+        """耗时的 q 分位数（0-100），记录不足时返回 None"""
+        samples = sorted(self.stats.get(stage, {}).get(step, []))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q / 100 * (len(samples) - 1)))))
+        return samples[index]
+
+    def schedule(self, stage, step):
+        """根据历史耗时给出检查计划，返回 (首次检查前的等待秒数, 频繁检查截止时间)
+
+        首次检查安排在 p10 之前一点，p90 之后一段时间内保持频繁检查；
+        没有足够记录时返回 (0, None)，即立即开始按固定间隔检查
+        """
+        p10 = self.percentile(stage, step, 10)
+        p90 = self.percentile(stage, step, 90)
+        if p10 is None or p90 is None:
+            return 0, None
+        return p10 * 0.9, p90 * 1.1
@@ -0,0 +1,134 @@
+import re
+
+# Linux 输入事件类型和编码
+EV_SYN = 0
+EV_KEY = 1
+EV_ABS = 3
+SYN_REPORT = 0
+SYN_MT_REPORT = 2
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_TOUCH_MAJOR = 0x30
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+ABS_MT_PRESSURE = 0x3a
+
+
+class TouchDevice:
+    """通过 sendevent 直接写入触摸事件的触摸屏
+
+    input tap 每次都要在设备上启动一个 Java 进程，点击生效前就要几百毫秒；
+    sendevent 是很小的原生程序，直接写入 /dev/input/eventN，延迟低得多。
+    设备和坐标范围由 getevent -p 的输出确定（from_getevent）。
+    """
+
+    def __init__(self, path, max_x, max_y, min_x=0, min_y=0, abs_max=None, key_codes=()):
+        self.path = path
+        self.min_x = min_x
+        self.max_x = max_x
+        self.min_y = min_y
+        self.max_y = max_y
+        self.abs_max = dict(abs_max or {})  # 支持的 ABS 编码 {编码: 最大值}
+        self.key_codes = set(key_codes)     # 支持的按键编码
+        self._tracking_id = 0
+
+    def __repr__(self):
+        return f"TouchDevice({self.path}, x={self.min_x}-{self.max_x}, y={self.min_y}-{self.max_y})"
+
+    @classmethod
+    def from_getevent(cls, output):
+        """解析 getevent -p 的输出，返回第一个多点触摸设备，没有时返回 None"""
+        devices = []
+        path, section, abs_ranges, key_codes = None, None, {}, set()
+        for line in output.splitlines() + ["add device"]:
+            line = line.strip()
+            if line.startswith("add device"):
+                if path is not None:
+                    devices.append((path, abs_ranges, key_codes))
+                path = line.split(":", 1)[1].strip() if ":" in line else None
+                section, abs_ranges, key_codes = None, {}, set()
+                continue
+
+            header = re.match(r"(\w+)\s+\(([0-9a-f]{4})\):\s*(.*)", line)
+            if header:
+                section = header.group(1)
+                line = header.group(3)
+            elif line.endswith(":"):
+                section = None
+                continue
+
+            if section == "ABS":
+                for code, minimum, maximum in re.findall(r"([0-9a-f]{4})\s*:\s*value -?\d+, min (-?\d+), max (-?\d+)", line):
+                    abs_ranges[int(code, 16)] = (int(minimum), int(maximum))
+            elif section == "KEY":
+                key_codes.update(int(code, 16) for code in re.findall(r"\b[0-9a-f]{4}\b", line))
+
+        for path, abs_ranges, key_codes in devices:
+            if ABS_MT_POSITION_X in abs_ranges and ABS_MT_POSITION_Y in abs_ranges:
+                min_x, max_x = abs_ranges[ABS_MT_POSITION_X]
+                min_y, max_y = abs_ranges[ABS_MT_POSITION_Y]
+                return cls(path, max_x, max_y, min_x, min_y,
+                           {code: maximum for code, (_, maximum) in abs_ranges.items()}, key_codes)
+        return None
+
+    def to_device(self, x, y, screen_size, rotation=None):
+        """把截图坐标换算为触摸屏坐标
+
+        触摸屏的坐标按设备的自然方向，横屏运行时需要旋转：rotation 为屏幕相对
+        自然方向的旋转（0-3，每次 90 度），None 时根据两者的长宽方向判断（0 或 1）
+        """
+        width, height = screen_size
+        if rotation is None:
+            rotation = 0 if (width >= height) == (self.max_x >= self.max_y) else 1
+
+        # 换算到自然方向的屏幕坐标，nat_width/nat_height 为自然方向的宽高
+        if rotation == 1:
+            x, y, nat_width, nat_height = height - 1 - y, x, height, width
+        elif rotation == 2:
+            x, y, nat_width, nat_height = width - 1 - x, height - 1 - y, width, height
+        elif rotation == 3:
+            x, y, nat_width, nat_height = y, width - 1 - x, height, width
+        else:
+            nat_width, nat_height = width, height
+
+        device_x = self.min_x + round(x * (self.max_x - self.min_x) / max(1, nat_width - 1))
+        device_y = self.min_y + round(y * (self.max_y - self.min_y) / max(1, nat_height - 1))
+        return device_x, device_y
+
+    def tap_command(self, x, y, screen_size, rotation=None):
+        """生成一次点击（按下并抬起）的 sendevent 命令"""
+        device_x, device_y = self.to_device(x, y, screen_size, rotation)
+        tracking = ABS_MT_TRACKING_ID in self.abs_max
+        commands = []
+
+        def event(event_type, code, value):
+            commands.append(f"sendevent {self.path} {event_type} {code} {value}")
+
+        # 按下
+        if ABS_MT_SLOT in self.abs_max:
+            event(EV_ABS, ABS_MT_SLOT, 0)
+        if tracking:
+            self._tracking_id = (self._tracking_id + 1) % 65535
+            event(EV_ABS, ABS_MT_TRACKING_ID, self._tracking_id)
+        if BTN_TOUCH in self.key_codes:
+            event(EV_KEY, BTN_TOUCH, 1)
+        event(EV_ABS, ABS_MT_POSITION_X, device_x)
+        event(EV_ABS, ABS_MT_POSITION_Y, device_y)
+        if ABS_MT_TOUCH_MAJOR in self.abs_max:
+            event(EV_ABS, ABS_MT_TOUCH_MAJOR, 5)
+        if self.abs_max.get(ABS_MT_PRESSURE, 0) > 0:
+            event(EV_ABS, ABS_MT_PRESSURE, max(1, self.abs_max[ABS_MT_PRESSURE] // 2))
+        if not tracking:
+            event(EV_SYN, SYN_MT_REPORT, 0)
+        event(EV_SYN, SYN_REPORT, 0)
+
+        # 抬起
+        if tracking:
+            event(EV_ABS, ABS_MT_TRACKING_ID, -1)
+        if BTN_TOUCH in self.key_codes:
+            event(EV_KEY, BTN_TOUCH, 0)
+        if not tracking:
+            event(EV_SYN, SYN_MT_REPORT, 0)
+        event(EV_SYN, SYN_REPORT, 0)
+        return "; ".join(commands)